@@ -0,0 +1,342 @@
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from dotenv import load_dotenv
+from playwright.async_api import async_playwright
+from playwright_stealth import Stealth
+
+load_dotenv()
+
+# Chromium processes kept running; 0 launches a throwaway browser per fetch
+BROWSER_POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", "1"))
+# Pages (each in its own stealth context) a browser serves at once
+BROWSER_PAGES_PER_BROWSER = int(os.getenv("BROWSER_PAGES_PER_BROWSER", "4"))
+# Replace a page after this many navigations to shed whatever it accumulated
+BROWSER_PAGE_MAX_NAVIGATIONS = int(os.getenv("BROWSER_PAGE_MAX_NAVIGATIONS", "20"))
+# How long a fetch waits for a free page
+BROWSER_CHECKOUT_TIMEOUT = float(os.getenv("BROWSER_CHECKOUT_TIMEOUT", "60"))
+# Resource types a fetch never downloads; scraping only needs the document and its scripts
+BROWSER_BLOCKED_RESOURCES = {
+    t.strip() for t in os.getenv("BROWSER_BLOCKED_RESOURCES", "image,media,font,stylesheet").split(",") if t.strip()
+}
+# Domains whose pages load every resource (a subdomain counts as its domain)
+BROWSER_ALLOW_RESOURCES = [
+    d.strip().lower() for d in os.getenv("BROWSER_ALLOW_RESOURCES", "").split(",") if d.strip()
+]
+# What to wait for after the DOM is parsed: the default selector, and
+# per-domain overrides as "domain=selector" pairs separated by ";"
+BROWSER_WAIT_SELECTOR = os.getenv("BROWSER_WAIT_SELECTOR", "table")
+BROWSER_DOMAIN_WAIT_SELECTORS = os.getenv("BROWSER_DOMAIN_WAIT_SELECTORS", "")
+# Seconds to wait for the selector to appear, and then for it to stop changing
+BROWSER_SELECTOR_TIMEOUT = float(os.getenv("BROWSER_SELECTOR_TIMEOUT", "10"))
+BROWSER_SETTLE_TIMEOUT = float(os.getenv("BROWSER_SETTLE_TIMEOUT", "5"))
+# The match counts as settled once unchanged for this long (seconds)
+BROWSER_SETTLE_QUIET = float(os.getenv("BROWSER_SETTLE_QUIET", "1"))
+BROWSER_SETTLE_INTERVAL = 0.25
+
+LAUNCH_ARGS = [
+    "--no-sandbox",
+    "--disable-blink-features=AutomationControlled",
+    "--disable-web-security",
+    "--disable-features=VizDisplayCompositor",
+]
+
+# Additional headers to appear more like a real user
+EXTRA_HEADERS = {
+    "Accept-Language": "en-US,en;q=0.9",
+    "Accept-Encoding": "gzip, deflate, br",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
+    "Connection": "keep-alive",
+    "Upgrade-Insecure-Requests": "1",
+}
+
+# Analytics and ad hosts whose requests are dropped along with the blocked types
+TRACKER_HOSTS = [
+    "google-analytics.com", "googletagmanager.com", "doubleclick.net",
+    "googlesyndication.com", "adservice.google.com", "facebook.net",
+    "scorecardresearch.com", "quantserve.com", "hotjar.com", "segment.io",
+    "criteo.com", "taboola.com", "outbrain.com", "amazon-adsystem.com",
+]
+
+# Elements matching the selector, where a table only counts once it holds data
+# (at least three rows and two cells, like data_scrape.has_usable_table): layout
+# and infobox tables are often there long before the data table is rendered
+_MATCHES_JS = (
+    "(s => Array.from(document.querySelectorAll(s)).filter(e => e.tagName !== 'TABLE'"
+    " || (e.querySelectorAll('tr').length >= 3 && e.querySelectorAll('td').length >= 2)))"
+)
+SELECTOR_READY_JS = f"s => {_MATCHES_JS}(s).length > 0"
+# Sum of the matched elements' markup sizes, to tell when they stop changing
+SELECTOR_SIGNATURE_JS = f"s => {_MATCHES_JS}(s).reduce((n, e) => n + e.outerHTML.length, 0)"
+
+
+def _host(url: str) -> str:
+    return urlparse(url).netloc.lower().split(":")[0]
+
+
+def _matches(host: str, domain: str) -> bool:
+    return host == domain or host.endswith("." + domain)
+
+
+def _parse_domain_selectors(spec: str) -> Dict[str, str]:
+    selectors = {}
+    for item in spec.split(";"):
+        domain, _, selector = item.partition("=")
+        if domain.strip() and selector.strip():
+            selectors[domain.strip().lower()] = selector.strip()
+    return selectors
+
+
+DOMAIN_WAIT_SELECTORS = _parse_domain_selectors(BROWSER_DOMAIN_WAIT_SELECTORS)
+
+
+def wait_selector(url: str) -> str:
+    host = _host(url)
+    # The most specific configured domain wins
+    for domain in sorted(DOMAIN_WAIT_SELECTORS, key=len, reverse=True):
+        if _matches(host, domain):
+            return DOMAIN_WAIT_SELECTORS[domain]
+    return BROWSER_WAIT_SELECTOR
+
+
+def blocks_resources(url: str) -> bool:
+    host = _host(url)
+    return not any(_matches(host, domain) for domain in BROWSER_ALLOW_RESOURCES)
+
+
+async def settle(page, url: str):
+    """After domcontentloaded: wait until the page has a data table (or the
+    domain's configured selector matches) and it has not changed for
+    BROWSER_SETTLE_QUIET seconds.
+
+    Gives up quietly on either timeout; the caller takes whatever the DOM
+    holds by then.
+    """
+    selector = wait_selector(url)
+    try:
+        await page.wait_for_function(SELECTOR_READY_JS, arg=selector, timeout=BROWSER_SELECTOR_TIMEOUT * 1000)
+    except Exception:
+        print(f"⏳ No '{selector}' with data on {url} after {BROWSER_SELECTOR_TIMEOUT:.0f}s, using the DOM as is")
+        return
+    deadline = time.monotonic() + BROWSER_SETTLE_TIMEOUT
+    previous, unchanged_since = None, time.monotonic()
+    while time.monotonic() < deadline:
+        signature = await page.evaluate(SELECTOR_SIGNATURE_JS, selector)
+        now = time.monotonic()
+        if signature != previous:
+            previous, unchanged_since = signature, now
+        elif now - unchanged_since >= BROWSER_SETTLE_QUIET:
+            return
+        await asyncio.sleep(BROWSER_SETTLE_INTERVAL)
+    print(f"⏳ '{selector}' on {url} still changing after {BROWSER_SETTLE_TIMEOUT:.0f}s, using it as is")
+
+
+async def _new_context(browser):
+    context = await browser.new_context()
+    await Stealth().apply_stealth_async(context)
+    await context.set_extra_http_headers(EXTRA_HEADERS)
+    return context
+
+
+class BrowserSlot:
+    """One Chromium process, relaunched when it crashes or disconnects"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.browser = None
+        # Bumped on every launch so pages of a dead browser are recognised
+        self.generation = 0
+        self._lock = asyncio.Lock()
+
+    def alive(self) -> bool:
+        return self.browser is not None and self.browser.is_connected()
+
+    async def ensure(self, playwright):
+        async with self._lock:
+            if self.alive():
+                return
+            if self.browser is not None:
+                print(f"💥 Browser {self.index} crashed or disconnected, relaunching")
+            started = time.monotonic()
+            self.browser = await playwright.chromium.launch(headless=True, args=LAUNCH_ARGS)
+            self.generation += 1
+            print(f"🧭 Browser {self.index} launched in {time.monotonic() - started:.2f}s")
+
+    async def close(self):
+        if self.alive():
+            await self.browser.close()
+        self.browser = None
+
+
+class Tab:
+    """A stealth-patched context and its current page, reused across fetches"""
+
+    def __init__(self, slot: BrowserSlot):
+        self.slot = slot
+        self.context = None
+        self.page = None
+        self.generation = 0
+        self.navigations = 0
+        self.crashed = False
+
+    def _on_crash(self, _page):
+        self.crashed = True
+
+    async def ready(self, playwright):
+        await self.slot.ensure(playwright)
+        if self.context is None or self.generation != self.slot.generation:
+            # New or relaunched browser: the old context and page went with it
+            self.context = await _new_context(self.slot.browser)
+            self.generation = self.slot.generation
+            self.page = None
+        if (
+            self.page is None
+            or self.page.is_closed()
+            or self.crashed
+            or self.navigations >= BROWSER_PAGE_MAX_NAVIGATIONS
+        ):
+            await self._close_page()
+            self.page = await self.context.new_page()
+            self.page.on("crash", self._on_crash)
+            self.navigations = 0
+            self.crashed = False
+        return self.page
+
+    async def _close_page(self):
+        if self.page is not None and not self.page.is_closed():
+            try:
+                await self.page.close()
+            except Exception:
+                pass
+        self.page = None
+
+
+class BrowserPool:
+    """Long-lived Chromium browsers shared by every scrape.
+
+    Each browser serves a fixed number of tabs (a stealth-patched context
+    plus a page) that are checked out one fetch at a time. Pages are
+    replaced after BROWSER_PAGE_MAX_NAVIGATIONS fetches or when they crash,
+    and a browser that crashed is relaunched on the next checkout.
+    """
+
+    def __init__(self, size: int, pages_per_browser: int):
+        self.size = size
+        self.pages_per_browser = max(1, pages_per_browser)
+        self._playwright = None
+        self._slots: List[BrowserSlot] = []
+        self._tabs: Optional[asyncio.Queue] = None
+        self._loop = None
+        self._start_lock = None
+        self.blocked_requests = 0
+
+    async def _block_route(self, route):
+        request = route.request
+        host = _host(request.url)
+        if request.resource_type in BROWSER_BLOCKED_RESOURCES or any(
+            _matches(host, tracker) for tracker in TRACKER_HOSTS
+        ):
+            self.blocked_requests += 1
+            await route.abort()
+        else:
+            await route.continue_()
+
+    @asynccontextmanager
+    async def _blocking(self, page, url: Optional[str]):
+        """Drop images, fonts, stylesheets, media and trackers while fetching url"""
+        if url is None or not blocks_resources(url):
+            yield
+            return
+        await page.route("**/*", self._block_route)
+        try:
+            yield
+        finally:
+            # Tabs are reused, possibly for an allowlisted domain next
+            if not page.is_closed():
+                try:
+                    await page.unroute("**/*", self._block_route)
+                except Exception:
+                    pass
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Playwright objects belong to the event loop that created them
+            self._loop = loop
+            self._start_lock = asyncio.Lock()
+            self._playwright = None
+        async with self._start_lock:
+            if self._playwright is not None or self.size <= 0:
+                return
+            self._playwright = await async_playwright().start()
+            self._slots = [BrowserSlot(i) for i in range(self.size)]
+            self._tabs = asyncio.Queue()
+            for slot in self._slots:
+                for _ in range(self.pages_per_browser):
+                    self._tabs.put_nowait(Tab(slot))
+            await asyncio.gather(*(slot.ensure(self._playwright) for slot in self._slots))
+
+    async def warm_up(self):
+        """Lifespan hook: launch the browsers without delaying startup on failure"""
+        try:
+            await self.start()
+        except Exception as e:
+            print(f"⚠️ Failed to start browser pool: {e}")
+
+    @asynccontextmanager
+    async def page(self, url: Optional[str] = None):
+        """Check out a ready page; it goes back to the pool when the block exits.
+
+        Given the URL about to be fetched, non-essential resources are blocked
+        for the duration unless its domain is in BROWSER_ALLOW_RESOURCES.
+        """
+        if self.size <= 0:
+            async with async_playwright() as p:
+                browser = await p.chromium.launch(headless=True, args=LAUNCH_ARGS)
+                try:
+                    context = await _new_context(browser)
+                    page = await context.new_page()
+                    async with self._blocking(page, url):
+                        yield page
+                finally:
+                    await browser.close()
+            return
+
+        await self.start()
+        try:
+            tab = await asyncio.wait_for(self._tabs.get(), BROWSER_CHECKOUT_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"No browser page became free within {BROWSER_CHECKOUT_TIMEOUT:.0f}s")
+        try:
+            page = await tab.ready(self._playwright)
+            async with self._blocking(page, url):
+                yield page
+        finally:
+            tab.navigations += 1
+            self._tabs.put_nowait(tab)
+
+    def stats(self) -> dict:
+        return {
+            "browsers": self.size,
+            "alive": sum(slot.alive() for slot in self._slots),
+            "idle_pages": self._tabs.qsize() if self._tabs is not None else 0,
+            "launches": sum(slot.generation for slot in self._slots),
+            "blocked_requests": self.blocked_requests,
+        }
+
+    async def close(self):
+        """Close every browser. Called from the FastAPI lifespan on shutdown."""
+        if self._playwright is None:
+            return
+        await asyncio.gather(*(slot.close() for slot in self._slots), return_exceptions=True)
+        await self._playwright.stop()
+        self._playwright = None
+        self._slots = []
+        self._tabs = None
+
+
+pool = BrowserPool(BROWSER_POOL_SIZE, BROWSER_PAGES_PER_BROWSER)
@@ -0,0 +1,220 @@
+import ast
+import asyncio
+import os
+import re
+import time
+from typing import Awaitable, Callable, List, Optional
+
+import import_check
+import llm_router
+
+DATA_SOURCE_PATTERN = re.compile(
+    r"read_(?:csv|parquet|json)(?:_auto)?\(\s*\[?\s*['\"]([^'\"]+)['\"]"
+)
+# Lines that continue the previous top-level statement rather than start one
+CONTINUATION_PREFIXES = (")", "]", "}", "else", "elif", "except", "finally", "#", "@")
+
+
+def strip_code_fences(text: str) -> str:
+    """Drop markdown fence lines (```python / ```) from model output"""
+    return "\n".join(
+        line for line in text.split("\n") if not line.strip().startswith("```")
+    )
+
+
+class IncrementalCodeParser:
+    """Validate generated code statement by statement while it streams in.
+
+    Each time a chunk completes one or more top-level statements, that segment is
+    parsed on its own; imports and referenced data sources found in it are
+    reported immediately through the callbacks.
+    """
+
+    def __init__(
+        self,
+        on_import: Optional[Callable[[str], None]] = None,
+        on_data_source: Optional[Callable[[str], None]] = None,
+    ):
+        self.text = ""
+        self.imports: List[str] = []
+        self.data_sources: List[str] = []
+        self.statements = 0
+        self._validated = 0
+        self._on_import = on_import
+        self._on_data_source = on_data_source
+
+    def feed(self, chunk: str):
+        self.text += chunk
+        code = strip_code_fences(self.text)
+        complete = code[: code.rfind("\n") + 1]
+
+        # Find the last line start that opens a new top-level statement; the
+        # text between the validated offset and that point is a whole block
+        boundary = None
+        offset = len(complete)
+        for line in reversed(complete[self._validated:].splitlines(keepends=True)):
+            offset -= len(line)
+            if line[:1] not in ("", " ", "\t", "\n") and not line.startswith(
+                CONTINUATION_PREFIXES
+            ):
+                if offset > self._validated:
+                    boundary = offset
+                    break
+        if boundary is None:
+            return
+        self._consume(complete[self._validated:boundary], boundary)
+
+    def _consume(self, segment: str, boundary: int):
+        try:
+            tree = ast.parse(segment)
+        except SyntaxError:
+            # Most likely a multi-line string or bracket still open: wait for more
+            return
+        self._validated = boundary
+        self.statements += len(tree.body)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                for alias in node.names:
+                    self._add_import(alias.name.split(".")[0])
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                self._add_import(node.module.split(".")[0])
+        for path in DATA_SOURCE_PATTERN.findall(segment):
+            if path not in self.data_sources:
+                self.data_sources.append(path)
+                if self._on_data_source:
+                    self._on_data_source(path)
+
+    def _add_import(self, module: str):
+        if module not in self.imports:
+            self.imports.append(module)
+            if self._on_import:
+                self._on_import(module)
+
+    def finish(self) -> Optional[SyntaxError]:
+        """Validate whatever is left once the stream ends; return any syntax error"""
+        code = strip_code_fences(self.text)
+        if len(code) > self._validated:
+            self._consume(code[self._validated:], len(code))
+        try:
+            ast.parse(code)
+        except SyntaxError as e:
+            return e
+        return None
+
+
+def _warm_local_file(path: str):
+    # Pull the file into the OS page cache so the script's first read is cheap
+    with open(path, "rb") as f:
+        while f.read(1024 * 1024):
+            pass
+
+
+class CodegenPrefetcher:
+    """Starts execution-side preparation as soon as the stream reveals what is needed"""
+
+    # Async callables run once when generation starts (e.g. warming an executor)
+    warmup_hooks: List[Callable[[], Awaitable[None]]] = []
+
+    def __init__(self, allowed_paths: List[str]):
+        self.allowed_paths = allowed_paths
+        self.tasks: List[asyncio.Task] = []
+        self.missing_modules: List[str] = []
+
+    def start(self):
+        for hook in self.warmup_hooks:
+            self._spawn(hook(), "warmup")
+
+    def on_import(self, module: str):
+        self._spawn(self._check_import(module), f"import {module}")
+
+    async def _check_import(self, module: str):
+        # Starts any wheelhouse install while the rest of the code is streaming
+        if not await import_check.ensure_module(module):
+            self.missing_modules.append(module)
+            print(f"⚠️ Generated code imports unavailable module: {module}")
+
+    def on_data_source(self, path: str):
+        path = self._resolve(path)
+        if path is None:
+            return
+        # Only local files are warmed: remote data is read by the sandboxed
+        # script's own connection, which a server-side read would not help
+        if os.path.exists(path):
+            self._spawn(asyncio.to_thread(_warm_local_file, path), f"load {path}")
+
+    def _resolve(self, path: str) -> Optional[str]:
+        """Map a path from the code to its allowed source (workspace files may be relative)"""
+        if path in self.allowed_paths:
+            return path
+        for allowed in self.allowed_paths:
+            if os.path.basename(allowed) == os.path.basename(path):
+                return allowed
+        return None
+
+    def _spawn(self, coro, label: str):
+        started = time.time()
+
+        def done(task: asyncio.Task):
+            if task.cancelled():
+                return
+            if task.exception() is not None:
+                print(f"⚠️ Prefetch failed for {label}: {task.exception()}")
+            else:
+                print(f"⚡ Prefetched {label} in {time.time() - started:.2f}s")
+
+        # The coroutine is the task itself, so cancelling it before it starts closes it
+        task = asyncio.ensure_future(coro)
+        task.add_done_callback(done)
+        self.tasks.append(task)
+
+    async def close(self):
+        """Cancel whatever is still pending once generation is over.
+
+        Module installs are shared with the import check that runs before the
+        script and carry on regardless; file reads already in a thread finish
+        on their own.
+        """
+        pending = [task for task in self.tasks if not task.done()]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        self.tasks.clear()
+
+
+async def stream_generate_code(
+    endpoints: List[str],
+    question_text: str,
+    relevant_context: str,
+    prefetcher: Optional[CodegenPrefetcher] = None,
+    timeout: float = 120,
+    prefix=None,
+) -> str:
+    """Stream code from the LLM, parsing and prefetching as statements complete"""
+    parser = IncrementalCodeParser(
+        on_import=prefetcher.on_import if prefetcher else None,
+        on_data_source=prefetcher.on_data_source if prefetcher else None,
+    )
+    if prefetcher:
+        prefetcher.start()
+
+    started = time.time()
+    first_token = None
+    try:
+        async for chunk in llm_router.router.stream(
+            endpoints, question_text, relevant_context, timeout=timeout, prefix=prefix
+        ):
+            if first_token is None:
+                first_token = time.time() - started
+            parser.feed(chunk)
+    finally:
+        if prefetcher:
+            await prefetcher.close()
+
+    syntax_error = parser.finish()
+    print(
+        f"📝 Streamed {parser.statements} statements in {time.time() - started:.2f}s "
+        f"(first token {first_token or 0:.2f}s, imports: {parser.imports})"
+    )
+    if syntax_error:
+        print(f"⚠️ Generated code has a syntax error at line {syntax_error.lineno}: {syntax_error.msg}")
+    return parser.text
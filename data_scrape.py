@@ -5,64 +5,114 @@ import json
 from typing import Dict, List, Optional, Any
 import numpy as np
 import asyncio
-from playwright.async_api import async_playwright
-from playwright_stealth import Stealth
 import httpx
 import os
+import time
+from urllib.parse import urlparse
 from dotenv import load_dotenv
 from io import StringIO
+from contextlib import asynccontextmanager
+import http_clients
+from disk_cache import llm_cache, make_key
+import singleflight
+import llm_router
+import browser_pool
+import page_cache
 
 load_dotenv()
-GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
+GEMINI_API_URL = llm_router.GEMINI_FLASH_URL
 gemini_api = os.getenv("gemini_api")
 
-async def ping_gemini(question_text, relevant_context="", max_tries=3):
-    tries = 0
-    while tries < max_tries:
-        try:
-            print(f"gemini is running {tries + 1} try")
-            
-            # Check if API key is available
-            if not gemini_api:
-                print("❌ Gemini API key not found in environment variables")
-                return {"error": "Gemini API key not configured"}
-            
-            headers = {
-                "Content-Type": "application/json",
-                "X-goog-api-key": gemini_api
-            }
-            payload = {
-                "contents": [
-                    {
-                        "parts": [
-                            {"text": relevant_context},
-                            {"text": question_text}
-                        ]
-                    }
-                ]
-            }
-            async with httpx.AsyncClient(timeout=60) as client:
-                response = await client.post(GEMINI_API_URL, headers=headers, json=payload)
-                response.raise_for_status()
-                
-                # Debug: Print response content
-                response_text = response.text
-                print(f"Gemini response length: {len(response_text)}")
-                
-                if not response_text.strip():
-                    raise Exception("Empty response from Gemini API")
-                
-                try:
-                    return response.json()
-                except json.JSONDecodeError as json_error:
-                    print(f"JSON decode error: {json_error}")
-                    print(f"Response content: {response_text[:500]}...")
-                    raise Exception(f"Invalid JSON response: {json_error}")
-                    
-        except Exception as e:
-            print(f"Error during Gemini call: {e}")
-            tries += 1
-    return {"error": "Gemini failed after max retries"}
+# Fetch pages with a plain HTTP GET first and use the browser only for pages
+# whose tables are rendered by JavaScript or that turn away non-browser clients
+FETCH_TIERING = os.getenv("FETCH_TIERING", "1") != "0"
+# How long (seconds) the tier that worked for a domain is remembered
+FETCH_TIER_TTL = float(os.getenv("FETCH_TIER_TTL", "86400"))
+# Pages fetched from one host at a time, across all requests
+SCRAPE_PER_HOST_CONCURRENCY = int(os.getenv("SCRAPE_PER_HOST_CONCURRENCY", "2"))
+
+HTTP_FETCH_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36"
+    ),
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.9",
+}
+BOT_CHALLENGE_MARKERS = [
+    "cf-browser-verification", "challenge-platform", "just a moment...",
+    "captcha", "enable javascript", "javascript is disabled",
+]
+
+# Prompt fragments shared by the single-table and batched numeric identification
+NUMERIC_IDENTIFICATION_RULES = """Look for columns that contain:
+        1. Currency values (with symbols like $, €, £, ¥, etc.)
+        2. Percentages (with % symbol)
+        3. Numbers with formatting (commas, spaces, brackets)
+        4. Scientific notation (1.23e+05)
+        5. Mixed text-numeric values where numeric part can be extracted
+        6. Integer or float values that need type conversion
+        
+        IMPORTANT: Only identify columns that actually contain NUMERIC DATA, even if formatted as text.
+        DO NOT mark columns as numeric if they contain:
+        - Pure text/names/categories
+        - IDs/codes that are meant to stay as text
+        - Dates/timestamps (already excluded)
+        - Yes/No or True/False values"""
+
+NUMERIC_COLUMN_SCHEMA = """{
+                "is_numeric": true/false,
+                "numeric_type": "currency" | "percentage" | "integer" | "float" | "scientific",
+                "target_dtype": "int64" | "float64",
+                "cleaning_needed": true/false,
+                "confidence": "high" | "medium" | "low",
+                "description": "brief description of why this column is/isn't numeric"
+            }"""
+
+NUMERIC_IDENTIFICATION_EXAMPLES = """Examples of what SHOULD be identified as numeric:
+        - ["$1,234.56", "$2,000", "€500"] → currency
+        - ["45%", "12.5%", "100%"] → percentage  
+        - ["1.23e+05", "2.5E-03"] → scientific notation
+        - ["1,234,567", "2,000", "500"] → integer with formatting
+        - ["T$2,257,844", "F8$1,238"] → currency (extract numeric part)
+        
+        Examples of what should NOT be identified as numeric:
+        - ["Product A", "Category B", "Name"] → text
+        - ["ID001", "USER123", "CODE456"] → text IDs
+        - ["Yes", "No", "Maybe"] → categorical
+        - ["2023-01-01", "12:30:00"] → dates/times (already excluded)"""
+
+async def ping_gemini(question_text, relevant_context="", max_tries=3, cache=None):
+    """Call Gemini; pass a call-site label as `cache` to reuse persisted responses"""
+    request_key = make_key(GEMINI_API_URL, relevant_context, question_text)
+    if cache:
+        cached = llm_cache.get(request_key, site=cache)
+        if cached is not None:
+            print(f"⚡ LLM cache hit for {cache}")
+            return cached
+    
+    # Identical concurrent prompts share a single upstream request
+    return await singleflight.llm_calls.do(
+        request_key, _request_gemini, question_text, relevant_context, max_tries,
+        request_key if cache else None
+    )
+
+async def _request_gemini(question_text, relevant_context, max_tries, cache_key):
+    # Check if API key is available
+    if not gemini_api:
+        print("❌ Gemini API key not found in environment variables")
+        return {"error": "Gemini API key not configured"}
+    
+    # Prefer flash for these small structured prompts; hedge with 2.5-pro
+    endpoint, result = await llm_router.router.call_with_endpoint(
+        ["gemini-2.0-flash", "gemini-2.5-pro"], question_text, relevant_context,
+        max_tries=max_tries, timeout=60
+    )
+    # Only the preferred model's key is ever looked up, so a hedged or
+    # fallback answer is returned but not cached
+    if cache_key and result.get("candidates") and endpoint.url == GEMINI_API_URL:
+        llm_cache.set(cache_key, result)
+    return result
 
 class NumericFieldFormatter:
     """Handles identification and cleaning of numeric fields in DataFrames"""
@@ -71,10 +121,8 @@ class NumericFieldFormatter:
         self.currency_symbols = ['$', '€', '£', '¥', '₹', '₽', 'R$', 'A$', 'C$', '₦', '₨']
         self.percentage_indicators = ['%']
     
-    async def identify_numeric_columns(self, df: pd.DataFrame) -> Dict[str, str]:
-        """Use Gemini to identify which columns should be numeric and their types"""
-        
-        # Get sample data for analysis
+    def _column_samples(self, df: pd.DataFrame) -> tuple[List[Dict[str, Any]], List[str]]:
+        """Collect JSON-serializable column samples and the datetime columns to skip"""
         sample_data = []
         for col in df.columns:
             sample_values = df[col].dropna().head(10)
@@ -103,6 +151,36 @@ class NumericFieldFormatter:
             if pd.api.types.is_datetime64_any_dtype(df[col]) or pd.api.types.is_timedelta64_dtype(df[col]):
                 datetime_columns.append(col)
         
+        return sample_data, datetime_columns
+    
+    def _response_json(self, response: Dict[str, Any]) -> Any:
+        """Parse the JSON body of a Gemini response, raising ValueError if unusable"""
+        if "error" in response:
+            raise ValueError(f"Gemini API error: {response['error']}")
+        if "candidates" not in response or not response["candidates"]:
+            raise ValueError("No candidates in Gemini response")
+        
+        response_text = response["candidates"][0]["content"]["parts"][0]["text"]
+        print(f"Gemini response text length: {len(response_text)}")
+        
+        # Try to extract JSON from response (sometimes it's wrapped in markdown)
+        if "```json" in response_text:
+            json_start = response_text.find("```json") + 7
+            json_end = response_text.find("```", json_start)
+            response_text = response_text[json_start:json_end].strip()
+        elif "```" in response_text:
+            json_start = response_text.find("```") + 3
+            json_end = response_text.rfind("```")
+            response_text = response_text[json_start:json_end].strip()
+        
+        return json.loads(response_text)
+    
+    async def identify_numeric_columns(self, df: pd.DataFrame) -> Dict[str, str]:
+        """Use Gemini to identify which columns should be numeric and their types"""
+        
+        # Get sample data for analysis
+        sample_data, datetime_columns = self._column_samples(df)
+        
         identification_prompt = f"""
         Analyze these DataFrame columns and identify which ones contain NUMERIC DATA that needs cleaning:
         
@@ -110,76 +188,20 @@ class NumericFieldFormatter:
         
         Note: Skip these datetime columns from numeric formatting: {datetime_columns}
         
-        Look for columns that contain:
-        1. Currency values (with symbols like $, €, £, ¥, etc.)
-        2. Percentages (with % symbol)
-        3. Numbers with formatting (commas, spaces, brackets)
-        4. Scientific notation (1.23e+05)
-        5. Mixed text-numeric values where numeric part can be extracted
-        6. Integer or float values that need type conversion
-        
-        IMPORTANT: Only identify columns that actually contain NUMERIC DATA, even if formatted as text.
-        DO NOT mark columns as numeric if they contain:
-        - Pure text/names/categories
-        - IDs/codes that are meant to stay as text
-        - Dates/timestamps (already excluded)
-        - Yes/No or True/False values
+        {NUMERIC_IDENTIFICATION_RULES}
         
         Return a JSON object with this structure:
         {{
-            "column_name": {{
-                "is_numeric": true/false,
-                "numeric_type": "currency" | "percentage" | "integer" | "float" | "scientific",
-                "target_dtype": "int64" | "float64",
-                "cleaning_needed": true/false,
-                "confidence": "high" | "medium" | "low",
-                "description": "brief description of why this column is/isn't numeric"
-            }}
+            "column_name": {NUMERIC_COLUMN_SCHEMA}
         }}
         
-        Examples of what SHOULD be identified as numeric:
-        - ["$1,234.56", "$2,000", "€500"] → currency
-        - ["45%", "12.5%", "100%"] → percentage  
-        - ["1.23e+05", "2.5E-03"] → scientific notation
-        - ["1,234,567", "2,000", "500"] → integer with formatting
-        - ["T$2,257,844", "F8$1,238"] → currency (extract numeric part)
-        
-        Examples of what should NOT be identified as numeric:
-        - ["Product A", "Category B", "Name"] → text
-        - ["ID001", "USER123", "CODE456"] → text IDs
-        - ["Yes", "No", "Maybe"] → categorical
-        - ["2023-01-01", "12:30:00"] → dates/times (already excluded)
+        {NUMERIC_IDENTIFICATION_EXAMPLES}
         """
         
-        response = await ping_gemini(identification_prompt, "You are a data analysis expert specializing in numeric data identification. Return only valid JSON.")
+        response = await ping_gemini(identification_prompt, "You are a data analysis expert specializing in numeric data identification. Return only valid JSON.", cache="numeric_columns")
         
         try:
-            # Check if response has error
-            if "error" in response:
-                print(f"❌ Gemini API error: {response['error']}")
-                print("🔄 Falling back to heuristic identification...")
-                return self._fallback_numeric_identification(df)
-            
-            # Extract text from response
-            if "candidates" not in response or not response["candidates"]:
-                print("❌ No candidates in Gemini response")
-                print("🔄 Falling back to heuristic identification...")
-                return self._fallback_numeric_identification(df)
-            
-            response_text = response["candidates"][0]["content"]["parts"][0]["text"]
-            print(f"Gemini response text length: {len(response_text)}")
-            
-            # Try to extract JSON from response (sometimes it's wrapped in markdown)
-            if "```json" in response_text:
-                json_start = response_text.find("```json") + 7
-                json_end = response_text.find("```", json_start)
-                response_text = response_text[json_start:json_end].strip()
-            elif "```" in response_text:
-                json_start = response_text.find("```") + 3
-                json_end = response_text.rfind("```")
-                response_text = response_text[json_start:json_end].strip()
-            
-            analysis = json.loads(response_text)
+            analysis = self._response_json(response)
             # Filter out datetime columns and non-numeric columns from analysis
             filtered_analysis = {}
             for col, info in analysis.items():
@@ -194,6 +216,72 @@ class NumericFieldFormatter:
             # Fallback to existing heuristic method
             return self._fallback_numeric_identification(df)
     
+    async def identify_numeric_columns_batch(self, tables: Dict[str, pd.DataFrame]) -> Dict[str, Dict[str, Any]]:
+        """Identify numeric columns for several tables with a single Gemini call.
+
+        Returns the per-table analysis keyed like `tables`. Any table the model
+        response does not cover (or the whole batch, if the call fails) falls
+        back to heuristic identification on its own.
+        """
+        if len(tables) == 1:
+            name, df = next(iter(tables.items()))
+            return {name: await self.identify_numeric_columns(df)}
+        
+        table_samples = {}
+        skipped = {}
+        for name, df in tables.items():
+            sample_data, datetime_columns = self._column_samples(df)
+            table_samples[name] = {"columns": sample_data, "skip_datetime_columns": datetime_columns}
+            skipped[name] = datetime_columns
+        
+        identification_prompt = f"""
+        Analyze the columns of each of these tables and identify which ones contain NUMERIC DATA that needs cleaning.
+        Tables are keyed by name; each lists column samples and datetime columns to skip.
+        
+        Tables: {json.dumps(table_samples, indent=2)}
+        
+        {NUMERIC_IDENTIFICATION_RULES}
+        
+        Return a JSON object with one entry per table name, each mapping column names to an analysis:
+        {{
+            "table_name": {{
+                "column_name": {NUMERIC_COLUMN_SCHEMA}
+            }}
+        }}
+        
+        {NUMERIC_IDENTIFICATION_EXAMPLES}
+        """
+        
+        response = await ping_gemini(identification_prompt, "You are a data analysis expert specializing in numeric data identification. Return only valid JSON.", cache="numeric_columns_batch")
+        
+        try:
+            analysis = self._response_json(response)
+            if not isinstance(analysis, dict):
+                raise ValueError("Batch response is not a JSON object")
+        except Exception as e:
+            print(f"❌ Error in batched Gemini numeric analysis: {e}")
+            print(f"🔄 Falling back to heuristic identification for {len(tables)} tables...")
+            analysis = {}
+        
+        results = {}
+        for name, df in tables.items():
+            table_analysis = analysis.get(name)
+            if not isinstance(table_analysis, dict):
+                if analysis:
+                    print(f"⚠️ Batched response missing table {name}, using heuristics")
+                results[name] = self._fallback_numeric_identification(df)
+                continue
+            results[name] = {
+                col: info
+                for col, info in table_analysis.items()
+                if col in df.columns
+                and col not in skipped[name]
+                and isinstance(info, dict)
+                and info.get("is_numeric", False)
+            }
+            print(f"✅ LLM identified {len(results[name])} numeric columns in {name}: {list(results[name].keys())}")
+        return results
+    
     def _fallback_numeric_identification(self, df: pd.DataFrame) -> Dict[str, str]:
         """Fallback method to identify numeric columns using heuristics"""
         numeric_columns = {}
@@ -429,15 +517,27 @@ class NumericFieldFormatter:
         
         return series.apply(clean_generic_value)
     
-    async def format_dataframe_numerics(self, df: pd.DataFrame) -> tuple[pd.DataFrame, Dict[str, Any]]:
+    async def format_dataframes_numerics(self, tables: Dict[str, pd.DataFrame]) -> Dict[str, tuple[pd.DataFrame, Dict[str, Any]]]:
+        """Format several DataFrames, identifying their numeric columns in one LLM call"""
+        if not tables:
+            return {}
+        print(f"🤖 Identifying numeric columns for {len(tables)} table(s) in one request...")
+        identified = await self.identify_numeric_columns_batch(tables)
+        return {
+            name: await self.format_dataframe_numerics(df, numeric_columns=identified[name])
+            for name, df in tables.items()
+        }
+    
+    async def format_dataframe_numerics(self, df: pd.DataFrame, numeric_columns: Optional[Dict[str, Any]] = None) -> tuple[pd.DataFrame, Dict[str, Any]]:
         """Main method to format all numeric fields in a DataFrame using LLM identification"""
         print("🤖 Starting LLM-powered numeric field formatting...")
         
         # Create a copy to avoid modifying original
         formatted_df = df.copy()
         
-        # Use LLM to identify numeric columns
-        numeric_columns = await self.identify_numeric_columns(formatted_df)
+        # Use LLM to identify numeric columns unless already identified in a batch
+        if numeric_columns is None:
+            numeric_columns = await self.identify_numeric_columns(formatted_df)
         
         if not numeric_columns:
             print("No numeric columns identified for formatting")
@@ -480,46 +580,187 @@ class NumericFieldFormatter:
         
         return formatted_df, formatting_results
 
+def has_usable_table(html: str) -> bool:
+    """True if the HTML already holds a data table (at least three rows with cells)"""
+    lowered = html.lower()
+    for chunk in lowered.split("<table")[1:]:
+        body = chunk.split("</table>", 1)[0]
+        if body.count("<tr") >= 3 and body.count("<td") >= 2:
+            return True
+    return False
+
+
+def looks_like_bot_challenge(html: str) -> bool:
+    head = html[:20000].lower()
+    return any(marker in head for marker in BOT_CHALLENGE_MARKERS)
+
+
+class FetchTiers:
+    """Remembers per domain whether plain HTTP was enough or the browser was needed"""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._tiers: Dict[str, tuple] = {}
+
+    def get(self, domain: str) -> Optional[str]:
+        entry = self._tiers.get(domain)
+        if entry is None or time.monotonic() - entry[1] > self.ttl:
+            return None
+        return entry[0]
+
+    def set(self, domain: str, tier: str):
+        self._tiers[domain] = (tier, time.monotonic())
+
+
+fetch_tiers = FetchTiers(FETCH_TIER_TTL)
+
+
+class HostLimiter:
+    """Caps concurrent fetches per host so parallel scrapes stay polite"""
+
+    def __init__(self, per_host: int):
+        self.per_host = max(1, per_host)
+        # host -> [semaphore, fetches holding or waiting for it]
+        self._hosts: Dict[str, list] = {}
+
+    @asynccontextmanager
+    async def slot(self, url: str):
+        host = urlparse(url).netloc.lower()
+        entry = self._hosts.setdefault(host, [asyncio.Semaphore(self.per_host), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._hosts[host]
+
+
+host_limits = HostLimiter(SCRAPE_PER_HOST_CONCURRENCY)
+
+
 class WebScraper:
     """Handles web scraping functionality"""
     
     async def fetch_webpage(self, url: str) -> str:
-        """Fetch webpage content using Playwright with stealth mode"""
-        stealth = Stealth()
-        
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(
-                headless=True,
-                args=[
-                    '--no-sandbox',
-                    '--disable-blink-features=AutomationControlled',
-                    '--disable-web-security',
-                    '--disable-features=VizDisplayCompositor'
-                ]
+        """Fetch webpage content, sharing one fetch between concurrent requests for the same URL"""
+        return await singleflight.page_fetches.do(
+            singleflight.normalize_url(url), self._fetch_cached, url
+        )
+
+    async def _fetch_cached(self, url: str) -> str:
+        """Serve fresh pages from the page cache, revalidate stale ones, fetch the rest"""
+        entry = page_cache.pages.get(url)
+        if entry is not None and page_cache.pages.is_fresh(entry):
+            print(f"📦 Page cache hit for {url} ({entry['tier']})")
+            return entry["html"]
+
+        async with host_limits.slot(url):
+            # A rendered page's tables come from requests other than the
+            # document, so only static pages can be revalidated
+            static = None
+            if entry is not None and entry["tier"] == "http" and entry["validators"]:
+                static = await self._revalidate(url, entry)
+                if static is None:
+                    return entry["html"]
+            try:
+                html, tier, page_validators = await self._fetch_tiered(url, static)
+            except Exception as e:
+                if entry is None:
+                    raise
+                print(f"⚠️ Fetching {url} failed ({e}), serving the cached copy")
+                return entry["html"]
+        # Pages without a table yield nothing anyway; do not pin a bad render
+        if has_usable_table(html):
+            page_cache.pages.put(url, tier, html, page_validators)
+        return html
+
+    async def _revalidate(self, url: str, entry: dict) -> Optional[tuple]:
+        """Conditional GET for a stale static page. None when it is unchanged and
+        the cached copy was refreshed; otherwise the response, judged like
+        _fetch_with_http, so the page is not requested over HTTP a second time"""
+        started = time.monotonic()
+        try:
+            response = await http_clients.get_client("scrape").get(
+                url, headers={**HTTP_FETCH_HEADERS, **page_cache.conditional_headers(entry)}
             )
-            context = await browser.new_context()
-            await stealth.apply_stealth_async(context)
-            
-            page = await context.new_page()
-            
-            # Set additional headers to appear more like a real user
-            await page.set_extra_http_headers({
-                'Accept-Language': 'en-US,en;q=0.9',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
-                'Connection': 'keep-alive',
-                'Upgrade-Insecure-Requests': '1',
-            })
-            
+        except httpx.HTTPError as e:
+            print(f"⚠️ Revalidating {url} failed ({e}), escalating to browser")
+            return None, False, {}
+        if response.status_code == 304:
+            print(f"📦 {url} unchanged (304), reusing the cached page")
+            page_cache.pages.revalidated(entry, response.headers)
+            return None
+        print(f"🔄 {url} changed since it was cached")
+        return self._judge_http_response(url, response, started)
+
+    async def _fetch_tiered(self, url: str, static: Optional[tuple] = None) -> tuple:
+        """Plain HTTP first, the browser only when the static HTML is not enough.
+        `static` is the outcome of an HTTP request already made for the page, as
+        returned by _fetch_with_http. Returns (html, tier, validators)"""
+        domain = urlparse(url).netloc.lower()
+        if static is None:
+            if not FETCH_TIERING:
+                return await self._fetch_with_playwright(url)
+            if fetch_tiers.get(domain) == "browser":
+                print(f"🧭 {domain} needed a browser before, skipping plain HTTP")
+                return await self._fetch_with_playwright(url)
+            static = await self._fetch_with_http(url)
+
+        html, blocked, page_validators = static
+        if html is not None:
+            fetch_tiers.set(domain, "http")
+            return html, "http", page_validators
+        rendered = await self._fetch_with_playwright(url)
+        # Only send the domain straight to the browser next time if the browser
+        # was really needed, not for a page that has no table either way
+        if blocked or has_usable_table(rendered[0]):
+            fetch_tiers.set(domain, "browser")
+        return rendered
+
+    async def _fetch_with_http(self, url: str) -> tuple:
+        """Pooled GET. Returns (html, blocked, validators): html is None when the
+        page needs the browser, and blocked tells whether the site turned the
+        client away"""
+        started = time.monotonic()
+        try:
+            response = await http_clients.get_client("scrape").get(url, headers=HTTP_FETCH_HEADERS)
+        except httpx.HTTPError as e:
+            print(f"↗️ HTTP fetch of {url} failed ({e}), escalating to browser")
+            return None, False, {}
+        return self._judge_http_response(url, response, started)
+
+    @staticmethod
+    def _judge_http_response(url: str, response: httpx.Response, started: float) -> tuple:
+        """(html, blocked, validators) of a static response, html None when the
+        page needs the browser"""
+        if response.status_code >= 400:
+            print(f"↗️ HTTP fetch of {url} returned {response.status_code}, escalating to browser")
+            return None, response.status_code in (401, 403, 429, 503), {}
+        html = response.text
+        if not has_usable_table(html):
+            blocked = looks_like_bot_challenge(html)
+            reason = "bot challenge" if blocked else "no table in static HTML"
+            print(f"↗️ {url}: {reason}, escalating to browser")
+            return None, blocked, {}
+        print(f"⚡ Fetched {url} over HTTP in {time.monotonic() - started:.2f}s")
+        return html, False, page_cache.validators(response.headers)
+    
+    async def _fetch_with_playwright(self, url: str) -> tuple:
+        """Fetch webpage content with a stealth-patched page from the shared browser
+        pool. Returns (html, "browser", {}): a 304 on the document says nothing
+        about the data rendered into it, so these pages expire on freshness only"""
+        async with browser_pool.pool.page(url) as page:
             try:
                 print(f"🌐 Fetching {url} with Playwright stealth mode...")
-                await page.goto(url, wait_until='networkidle', timeout=30000)
+                # Ad-heavy pages rarely go network-idle; wait for the table instead
+                await page.goto(url, wait_until='domcontentloaded', timeout=30000)
+                await browser_pool.settle(page, url)
                 content = await page.content()
-                await browser.close()
                 print("✅ Successfully fetched webpage with Playwright")
-                return content
+                return content, "browser", {}
             except Exception as e:
-                await browser.close()
                 raise Exception(f"Failed to fetch {url}: {str(e)}")
     
     async def extract_table_from_html(self, html_content: str) -> pd.DataFrame:
@@ -576,7 +817,8 @@ class WebScraper:
         
         response = await ping_gemini(
             analysis_prompt, 
-            "You are an HTML parsing expert. Analyze the structure and provide specific extraction guidance. Return only valid JSON."
+            "You are an HTML parsing expert. Analyze the structure and provide specific extraction guidance. Return only valid JSON.",
+            cache="extraction_strategy"
         )
         
         try:
@@ -1098,8 +1340,12 @@ class ImprovedWebScraper:
         self.numeric_formatter = NumericFieldFormatter()
         self.web_scraper = WebScraper()
     
-    async def extract_data(self, source_config: Dict[str, Any]) -> Dict[str, Any]:
-        """Main method to extract data from web sources"""
+    async def extract_data(self, source_config: Dict[str, Any], format_numerics: bool = True) -> Dict[str, Any]:
+        """Main method to extract data from web sources.
+
+        Pass format_numerics=False to get the raw table when the caller cleans
+        several tables together with format_dataframes_numerics().
+        """
         # Handle both URL string and config dict formats
         if isinstance(source_config, str):
             url = source_config
@@ -1108,6 +1354,11 @@ class ImprovedWebScraper:
             if not url:
                 raise Exception("No URL provided in source config")
         
+        # Concurrent requests for the same page share one scrape and cleaning pass
+        key = singleflight.normalize_url(url) + ("" if format_numerics else "#raw")
+        return await singleflight.scrapes.do(key, self._extract_url, url, format_numerics)
+    
+    async def _extract_url(self, url: str, format_numerics: bool = True) -> Dict[str, Any]:
         print(f"🚀 Starting data extraction for: {url}")
         
         # Fetch webpage
@@ -1122,7 +1373,10 @@ class ImprovedWebScraper:
         print(f"📊 Raw data extracted: {df.shape}")
         
         # Clean numeric fields using LLM
-        cleaned_df, formatting_results = await self.numeric_formatter.format_dataframe_numerics(df)
+        if format_numerics:
+            cleaned_df, formatting_results = await self.numeric_formatter.format_dataframe_numerics(df)
+        else:
+            cleaned_df, formatting_results = df, None
         
         print(f"✅ Data cleaning complete: {cleaned_df.shape}")
         
@@ -1143,4 +1397,8 @@ class ImprovedWebScraper:
         """Alias method for backward compatibility"""
         return await self.extract_data(url)
 
+
+# Shared by every request; holds no per-request state
+scraper = ImprovedWebScraper()
+
 # Example usage:
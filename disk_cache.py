@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def make_key(*parts: Any) -> str:
+    """Content-address a set of call arguments (model, system context, prompt, ...)"""
+    payload = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    """SQLite-backed key/value cache with TTL, size limits and LRU eviction"""
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = 5000,
+        max_bytes: int = 256 * 1024 * 1024,
+        default_ttl: float = 7 * 24 * 3600,
+        enabled: bool = True,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.enabled = enabled
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries(last_access)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def get(self, key: str, site: str = "default") -> Optional[Any]:
+        """Return the cached value for key, or None on a miss or expired entry"""
+        if not self.enabled:
+            return None
+        now = time.time()
+        try:
+            with self._lock:
+                conn = self._connect()
+                row = conn.execute(
+                    "SELECT value, expires_at FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None or row[1] < now:
+                    if row is not None:
+                        conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                        conn.commit()
+                    self.misses[site] += 1
+                    return None
+                conn.execute(
+                    "UPDATE entries SET last_access = ? WHERE key = ?", (now, key)
+                )
+                conn.commit()
+                self.hits[site] += 1
+                return json.loads(row[0])
+        except Exception as e:
+            print(f"⚠️ Cache read failed ({self.path}): {e}")
+            return None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        """Store a JSON-serializable value and evict old entries if over limits"""
+        if not self.enabled:
+            return
+        now = time.time()
+        ttl = self.default_ttl if ttl is None else ttl
+        try:
+            encoded = json.dumps(value, ensure_ascii=False, default=str)
+            with self._lock:
+                conn = self._connect()
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, encoded, len(encoded), now, now + ttl, now),
+                )
+                self._evict(conn, now)
+                conn.commit()
+        except Exception as e:
+            print(f"⚠️ Cache write failed ({self.path}): {e}")
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        """Drop expired entries, then least recently used ones until within limits"""
+        conn.execute("DELETE FROM entries WHERE expires_at < ?", (now,))
+        count, total = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        rows = conn.execute(
+            "SELECT key, size FROM entries ORDER BY last_access ASC"
+        ).fetchall()
+        evicted = []
+        for key, size in rows:
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            count -= 1
+            total -= size
+        conn.executemany("DELETE FROM entries WHERE key = ?", evicted)
+        print(f"🧹 Evicted {len(evicted)} entries from {self.path}")
+
+    def stats(self) -> dict:
+        """Hit/miss counters per call site plus current cache size"""
+        entries, total = 0, 0
+        try:
+            with self._lock:
+                entries, total = self._connect().execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+                ).fetchone()
+        except Exception:
+            pass
+        return {
+            "hits": dict(self.hits),
+            "misses": dict(self.misses),
+            "entries": entries,
+            "bytes": total,
+        }
+
+
+llm_cache = DiskCache(
+    os.getenv("LLM_CACHE_PATH", ".cache/llm_cache.sqlite3"),
+    max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000")),
+    max_bytes=int(os.getenv("LLM_CACHE_MAX_MB", "256")) * 1024 * 1024,
+    default_ttl=float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600))),
+    enabled=os.getenv("LLM_CACHE_ENABLED", "1") != "0",
+)
@@ -0,0 +1,138 @@
+import asyncio
+import contextlib
+import os
+import subprocess
+import time
+from typing import List, Optional
+
+from dotenv import load_dotenv
+
+import sandbox_harness
+import worker_pool
+
+load_dotenv()
+
+# Scripts allowed to run at once; the rest wait in FIFO order. Defaults to the
+# number of warm workers, so a script never waits for a worker after its turn
+# in the queue only to run cold (one per CPU when the pool is disabled)
+EXECUTION_CONCURRENCY = int(
+    os.getenv("EXECUTION_CONCURRENCY", str(worker_pool.WORKER_POOL_SIZE or os.cpu_count() or 1))
+)
+
+
+async def run_subprocess(
+    args: List[str], cwd: Optional[str] = None, timeout: float = 120
+) -> subprocess.CompletedProcess:
+    """Async equivalent of subprocess.run(args, capture_output=True, text=True, timeout=...)"""
+    proc = await asyncio.create_subprocess_exec(
+        *args,
+        cwd=cwd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        stdout, stderr = await proc.communicate()
+        raise subprocess.TimeoutExpired(
+            args, timeout, output=stdout.decode(errors="replace"), stderr=stderr.decode(errors="replace")
+        )
+    return subprocess.CompletedProcess(
+        args, proc.returncode, stdout.decode(errors="replace"), stderr.decode(errors="replace")
+    )
+
+
+class ExecutionQueue:
+    """Bounded, first-come-first-served queue for running generated scripts.
+
+    At most `concurrency` scripts run at a time, supervised from worker
+    threads, so the event loop keeps serving other requests while code
+    executes. Cancelling a job kills its script. Queue wait and run time are
+    recorded per job.
+    """
+
+    def __init__(self, concurrency: int):
+        self.concurrency = max(1, concurrency)
+        # asyncio.Semaphore wakes waiters in the order they arrived
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.queue_time = {"total": 0.0, "max": 0.0}
+        self.run_time = {"total": 0.0, "max": 0.0}
+
+    async def run(
+        self, script: str, cwd: Optional[str] = None, timeout: float = 120, runner=None
+    ) -> subprocess.CompletedProcess:
+        queued = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        waited = time.perf_counter() - queued
+
+        self.running += 1
+        started = time.perf_counter()
+        try:
+            # Runs on a warm worker, or cold when the pool is disabled or busy,
+            # unless another runner (such as a request's kernel) is given; all
+            # apply the sandbox limits and report resource usage
+            runner = runner or worker_pool.run_script
+            handle = worker_pool.ScriptHandle()
+            job = asyncio.ensure_future(asyncio.to_thread(runner, script, cwd, timeout, handle))
+            try:
+                result = await asyncio.shield(job)
+            except asyncio.CancelledError:
+                # Kill the script too, and keep its slot until it is gone
+                handle.cancel()
+                with contextlib.suppress(Exception):
+                    await job
+                raise
+            # The answer the script passed to emit_result(), if it used the channel
+            try:
+                result.emitted = sandbox_harness.read_result(cwd or os.getcwd())
+            except Exception as e:
+                print(f"⚠️ Could not decode emitted result, falling back to stdout: {e}")
+                result.emitted = None
+            return result
+        finally:
+            ran = time.perf_counter() - started
+            self.running -= 1
+            self.completed += 1
+            self._slots.release()
+            self._record(self.queue_time, waited)
+            self._record(self.run_time, ran)
+            print(
+                f"⏱️ {script}: queued {waited:.2f}s, ran {ran:.2f}s "
+                f"({self.running} running, {self.waiting} waiting)"
+            )
+
+    @staticmethod
+    def _record(metric: dict, value: float):
+        metric["total"] += value
+        metric["max"] = max(metric["max"], value)
+
+    def stats(self) -> dict:
+        done = self.completed or 1
+        return {
+            "concurrency": self.concurrency,
+            "running": self.running,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "avg_queue_time": round(self.queue_time["total"] / done, 3),
+            "max_queue_time": round(self.queue_time["max"], 3),
+            "avg_run_time": round(self.run_time["total"] / done, 3),
+            "max_run_time": round(self.run_time["max"], 3),
+        }
+
+
+execution_queue = ExecutionQueue(EXECUTION_CONCURRENCY)
+
+
+async def run_script(
+    script: str, cwd: Optional[str] = None, timeout: float = 120, runner=None
+) -> subprocess.CompletedProcess:
+    return await execution_queue.run(script, cwd=cwd, timeout=timeout, runner=runner)
+
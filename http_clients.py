@@ -0,0 +1,89 @@
+import asyncio
+import os
+from typing import Dict
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+# Pool settings per upstream provider. Each provider gets its own client so a
+# burst against one API cannot starve connections to another.
+PROVIDER_LIMITS = {
+    "gemini": {
+        "max_connections": _env_int("GEMINI_POOL_MAX_CONNECTIONS", 20),
+        "max_keepalive_connections": _env_int("GEMINI_POOL_MAX_KEEPALIVE", 10),
+        "timeout": 120.0,
+    },
+    "openai": {
+        "max_connections": _env_int("OPENAI_POOL_MAX_CONNECTIONS", 10),
+        "max_keepalive_connections": _env_int("OPENAI_POOL_MAX_KEEPALIVE", 5),
+        "timeout": 120.0,
+    },
+    "ocr": {
+        "max_connections": _env_int("OCR_POOL_MAX_CONNECTIONS", 5),
+        "max_keepalive_connections": _env_int("OCR_POOL_MAX_KEEPALIVE", 2),
+        "timeout": 30.0,
+    },
+    # Plain-HTTP page fetches for scraping (browser fetches are pooled separately)
+    "scrape": {
+        "max_connections": _env_int("SCRAPE_POOL_MAX_CONNECTIONS", 20),
+        "max_keepalive_connections": _env_int("SCRAPE_POOL_MAX_KEEPALIVE", 10),
+        "timeout": 20.0,
+    },
+}
+
+DEFAULT_LIMITS = {"max_connections": 10, "max_keepalive_connections": 5, "timeout": 60.0}
+KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+HTTP2_ENABLED = _http2_available()
+
+
+def get_client(provider: str) -> httpx.AsyncClient:
+    """Return the shared, pooled client for a provider, creating it on first use"""
+    client = _clients.get(provider)
+    if client is not None and not client.is_closed:
+        return client
+
+    settings = PROVIDER_LIMITS.get(provider, DEFAULT_LIMITS)
+    client = httpx.AsyncClient(
+        http2=HTTP2_ENABLED,
+        timeout=settings["timeout"],
+        follow_redirects=True,
+        limits=httpx.Limits(
+            max_connections=settings["max_connections"],
+            max_keepalive_connections=settings["max_keepalive_connections"],
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+    )
+    _clients[provider] = client
+    return client
+
+
+async def close_clients():
+    """Close every shared client. Called from the FastAPI lifespan on shutdown."""
+    clients = list(_clients.values())
+    _clients.clear()
+    await asyncio.gather(
+        *(client.aclose() for client in clients if not client.is_closed),
+        return_exceptions=True,
+    )
@@ -0,0 +1,179 @@
+import ast
+import importlib
+import importlib.util
+import os
+import sys
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+import executor
+import singleflight
+
+load_dotenv()
+
+# Optional directory of pre-downloaded wheels the sandbox may install from offline
+WHEELHOUSE_DIR = os.getenv("WHEELHOUSE_DIR", "")
+WHEEL_INSTALL_TIMEOUT = float(os.getenv("WHEEL_INSTALL_TIMEOUT", "120"))
+
+# Import names whose distribution is named differently
+DISTRIBUTION_NAMES = {
+    "sklearn": "scikit-learn",
+    "cv2": "opencv-python",
+    "PIL": "pillow",
+    "bs4": "beautifulsoup4",
+    "yaml": "pyyaml",
+    "dateutil": "python-dateutil",
+    "dotenv": "python-dotenv",
+    "skimage": "scikit-image",
+}
+
+# Libraries worth advertising to codegen when they are installed
+ADVERTISED_MODULES = [
+    "pandas", "numpy", "duckdb", "matplotlib", "seaborn", "plotly", "sklearn",
+    "scipy", "statsmodels", "networkx", "pyarrow", "bs4", "PIL",
+]
+
+wheel_installs = singleflight.SingleFlight("wheel install")
+
+
+def _normalize(name: str) -> str:
+    return name.lower().replace("_", "-")
+
+
+def find_imports(code: str) -> List[str]:
+    """Top-level module names imported by the code (statically, without running it)"""
+    modules = []
+
+    def add(name: Optional[str]):
+        if name:
+            top = name.split(".")[0]
+            if top not in modules:
+                modules.append(top)
+
+    for node in ast.walk(ast.parse(code)):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                add(alias.name)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            add(node.module)
+        elif (
+            isinstance(node, ast.Call)
+            and node.args
+            and isinstance(node.args[0], ast.Constant)
+            and isinstance(node.args[0].value, str)
+        ):
+            # __import__("x") and importlib.import_module("x")
+            func = node.func
+            name = func.id if isinstance(func, ast.Name) else getattr(func, "attr", "")
+            if name in ("__import__", "import_module"):
+                add(node.args[0].value)
+    return modules
+
+
+def is_available(module: str) -> bool:
+    if module in sys.stdlib_module_names or module in sys.builtin_module_names:
+        return True
+    try:
+        return importlib.util.find_spec(module) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def wheelhouse_distributions() -> Dict[str, str]:
+    """Normalized distribution name -> wheel file for everything in the wheelhouse"""
+    if not WHEELHOUSE_DIR or not os.path.isdir(WHEELHOUSE_DIR):
+        return {}
+    return {
+        _normalize(name.split("-")[0]): name
+        for name in os.listdir(WHEELHOUSE_DIR)
+        if name.endswith(".whl")
+    }
+
+
+def distribution_for(module: str) -> str:
+    return _normalize(DISTRIBUTION_NAMES.get(module, module))
+
+
+def available_packages() -> List[str]:
+    """Installed libraries plus wheelhouse packages, for the codegen prompt"""
+    packages = [m for m in ADVERTISED_MODULES if is_available(m)]
+    packages += sorted(d for d in wheelhouse_distributions() if d not in packages)
+    return packages
+
+
+async def _install_from_wheelhouse(distribution: str) -> bool:
+    result = await executor.run_subprocess(
+        [
+            sys.executable, "-m", "pip", "install", "--no-index",
+            "--find-links", WHEELHOUSE_DIR, distribution,
+        ],
+        timeout=WHEEL_INSTALL_TIMEOUT,
+    )
+    if result.returncode != 0:
+        print(f"❌ Wheelhouse install of {distribution} failed: {result.stderr[-300:]}")
+        return False
+    importlib.invalidate_caches()
+    print(f"📦 Installed {distribution} from wheelhouse")
+    return True
+
+
+class ImportReport:
+    def __init__(self, imports: List[str], installed: List[str], unsupported: List[str]):
+        self.imports = imports
+        self.installed = installed
+        self.unsupported = unsupported
+
+    @property
+    def ok(self) -> bool:
+        return not self.unsupported
+
+    def error_message(self) -> str:
+        """Feedback for the code fixer, shaped like the ImportError it replaces"""
+        return (
+            f"ModuleNotFoundError: No module named '{self.unsupported[0]}'\n"
+            f"These modules are not available in the sandbox and cannot be installed: "
+            f"{', '.join(self.unsupported)}.\n"
+            f"Rewrite the code using only the standard library and: {', '.join(available_packages())}"
+        )
+
+
+async def ensure_module(module: str) -> bool:
+    """Make a module importable, installing it from the wheelhouse if possible"""
+    if is_available(module):
+        return True
+    distribution = distribution_for(module)
+    if distribution not in wheelhouse_distributions():
+        return False
+    try:
+        installed = await wheel_installs.do(distribution, _install_from_wheelhouse, distribution)
+    except Exception as e:
+        print(f"❌ Wheelhouse install of {distribution} failed: {e}")
+        return False
+    return installed and is_available(module)
+
+
+async def check_code(code: str) -> ImportReport:
+    """Resolve every import of the code before it runs.
+
+    Modules that are missing but present in the wheelhouse are installed;
+    anything else missing is reported as unsupported so the caller can
+    reject the code without executing it.
+    """
+    try:
+        imports = find_imports(code)
+    except SyntaxError:
+        # Let the interpreter report the syntax error with its usual message
+        return ImportReport([], [], [])
+
+    installed, unsupported = [], []
+    for module in imports:
+        if is_available(module):
+            continue
+        if await ensure_module(module):
+            installed.append(module)
+        else:
+            unsupported.append(module)
+    if unsupported:
+        print(f"🚫 Generated code imports unavailable modules: {unsupported}")
+    return ImportReport(imports, installed, unsupported)
@@ -0,0 +1,537 @@
+import ast
+import builtins
+import json
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import warnings
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+import sandbox_harness
+import sandbox_limits
+import worker_pool
+
+load_dotenv()
+
+# Run a request's generated code in a persistent kernel, so a fix only re-runs
+# the statements from the first changed one onward (0 = always run whole scripts)
+ANALYSIS_KERNEL = os.getenv("ANALYSIS_KERNEL", "1") != "0"
+
+# Kernel files (sockets, per-cell output) live in this directory of the workspace
+KERNEL_DIR = ".kernel"
+# Keep a snapshot only once the cells since the previous one took this long
+# (seconds): cheaper cells are re-run rather than held in a paused process
+KERNEL_SNAPSHOT_MIN_SECONDS = float(os.getenv("KERNEL_SNAPSHOT_MIN_SECONDS", "0.25"))
+# Paused snapshot processes kept per kernel, besides the kernel itself
+KERNEL_MAX_SNAPSHOTS = int(os.getenv("KERNEL_MAX_SNAPSHOTS", "3"))
+
+
+def _cell_bounds(code: str) -> List[tuple]:
+    """(first_line, last_line, node) of each top-level statement"""
+    bounds = []
+    for node in ast.parse(code).body:
+        first = min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])])
+        bounds.append((first, node.end_lineno, node))
+    return bounds
+
+
+def split_cells(code: str) -> List[str]:
+    """Source of each top-level statement; raises SyntaxError like compile()"""
+    lines = code.splitlines()
+    return ["\n".join(lines[first - 1:last]) for first, last, _ in _cell_bounds(code)]
+
+
+def _socket_path(directory: str, cells_done: int) -> str:
+    return os.path.join(directory, f"snapshot-{cells_done}.sock")
+
+
+def _cell_output(directory: str, index: int, stream: str) -> str:
+    return os.path.join(directory, f"cell-{index}.{stream}")
+
+
+def _pid_alive(pid: int) -> bool:
+    # A kernel forked by a warm worker is not our child: check it is not a zombie
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            state = f.read().rsplit(")", 1)[1].split()[0]
+    except (OSError, IndexError):
+        return False
+    return state not in ("Z", "X")
+
+
+# ---------------------------------------------------------------------------
+# Kernel side. The kernel process holds an empty namespace and serves as the
+# first snapshot. Running cells forks a runner from a snapshot; after an
+# expensive stretch of cells (typically data loading) the runner forks again,
+# leaving a paused copy of its state behind as the snapshot to resume from when
+# a later cell changes. Snapshots join the kernel's process group, so killing
+# that group reaps them all.
+# ---------------------------------------------------------------------------
+
+# emit_result() as installed by the harness, before a runner wraps it
+_emit_result = None
+
+
+def _send(conn: socket.socket, message: dict):
+    conn.sendall((json.dumps(message) + "\n").encode("utf-8"))
+
+
+def _serve(listener: socket.socket, namespace: dict, directory: str):
+    """Snapshot main loop: fork a runner for every request; never returns"""
+    # Runners are not waited for; let the kernel reap them
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    while True:
+        conn, _ = listener.accept()
+        try:
+            request = json.loads(conn.makefile("r").readline())
+        except ValueError:
+            conn.close()
+            continue
+        if os.fork() == 0:
+            listener.close()
+            _run_cells(conn, request, namespace, directory)
+        conn.close()
+
+
+def _uses_duckdb(node: ast.AST, namespace: dict) -> bool:
+    """Whether a cell may have opened a DuckDB connection. DuckDB's threads and
+    HTTP state do not survive fork(), so no snapshot is taken from then on and
+    such cells always run again instead of being resumed."""
+    duckdb = sys.modules.get("duckdb")
+    if duckdb is None:
+        return False
+    if any(isinstance(value, duckdb.DuckDBPyConnection) for value in namespace.values()):
+        return True
+    if isinstance(node, (ast.Import, ast.ImportFrom)):
+        return False
+    # duckdb.sql() and friends use the module's default connection
+    names = {
+        name
+        for name, value in namespace.items()
+        if value is duckdb or str(getattr(value, "__module__", "")).startswith("duckdb")
+    }
+    return any(isinstance(sub, ast.Name) and sub.id in names for sub in ast.walk(node))
+
+
+def _snapshot(conn: socket.socket, cells_done: int, namespace: dict, directory: str):
+    path = _socket_path(directory, cells_done)
+    if os.path.exists(path):
+        os.unlink(path)
+    listener = socket.socket(socket.AF_UNIX)
+    listener.bind(path)
+    listener.listen()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        conn.close()
+        # Outlive the runner in the kernel's process group; until this point it
+        # is in the runner's group and dies with the runner
+        os.setpgid(0, os.getsid(0))
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        os.dup2(devnull, 2)
+        _serve(listener, namespace, directory)
+    listener.close()
+    _send(conn, {"snapshot": cells_done, "pid": pid})
+
+
+def _run_cells(conn: socket.socket, request: dict, namespace: dict, directory: str):
+    """Runner body: execute the script's cells from request["start"], then exit"""
+    # Its own process group, to be killed on cancel or timeout, but in the
+    # kernel's session so its snapshots can join the kernel's group
+    os.setpgid(0, 0)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    code = 0
+    try:
+        _send(conn, {"pid": os.getpid()})
+        script = os.path.abspath(request["script"])
+        with open(script, encoding="utf-8") as f:
+            source = f.read()
+        nodes = [node for _, _, node in _cell_bounds(source)]
+        cells = [compile(ast.Module(body=[node], type_ignores=[]), script, "exec") for node in nodes]
+        forkable = True
+        budget = request.get("snapshots", KERNEL_MAX_SNAPSHOTS)
+        since_snapshot = 0.0
+        namespace["__file__"] = script
+        current = [request["start"]]
+
+        def emit_result(obj):
+            _emit_result(obj)
+            _send(conn, {"emitted": current[0]})
+
+        builtins.emit_result = emit_result
+
+        for index in range(request["start"], len(cells)):
+            current[0] = index
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(os.open(_cell_output(directory, index, "out"), os.O_WRONLY | os.O_CREAT | os.O_TRUNC), 1)
+            os.dup2(os.open(_cell_output(directory, index, "err"), os.O_WRONLY | os.O_CREAT | os.O_TRUNC), 2)
+            cell_started = time.time()
+            try:
+                exec(cells[index], namespace)
+            except SystemExit as e:
+                if e.code is None:
+                    code = 0
+                elif isinstance(e.code, int):
+                    code = e.code
+                else:
+                    print(e.code, file=sys.stderr)
+                    code = 1
+                break
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+                break
+            _send(conn, {"ran": index + 1})
+            since_snapshot += time.time() - cell_started
+            forkable = forkable and not _uses_duckdb(nodes[index], namespace)
+            # Nothing runs after the last cell, so there is no state to resume
+            if (
+                forkable
+                and budget > 0
+                and since_snapshot >= KERNEL_SNAPSHOT_MIN_SECONDS
+                and index + 1 < len(cells)
+            ):
+                _snapshot(conn, index + 1, namespace, directory)
+                budget -= 1
+                since_snapshot = 0.0
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            _send(conn, {"done": code})
+        finally:
+            os._exit(0)
+
+
+def main(directory: str, workspace_dir: str, ready_fd: Optional[int] = None):
+    """Kernel process body. Usually forked from a warm worker, which has preloaded
+    the libraries and passes `ready_fd`; otherwise run as its own interpreter."""
+    global _emit_result
+    os.chdir(workspace_dir)
+    if ready_fd is None:
+        # The reply channel is only used for the ready handshake
+        ready = os.fdopen(os.dup(1), "w")
+        os.dup2(2, 1)
+        warnings.filterwarnings("ignore", message=".*use of fork\\(\\) may lead to deadlocks.*")
+        worker_pool._preload()
+    else:
+        ready = os.fdopen(ready_fd, "w")
+    sandbox_limits.apply_limits()
+    sandbox_harness.install()
+    _emit_result = builtins.emit_result
+    sys.argv = [""]
+    sys.path[0] = workspace_dir
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+
+    listener = socket.socket(socket.AF_UNIX)
+    path = _socket_path(directory, 0)
+    if os.path.exists(path):
+        os.unlink(path)
+    listener.bind(path)
+    listener.listen()
+    ready.write(json.dumps({"ready": True}) + "\n")
+    ready.close()
+    _serve(listener, {"__name__": "__main__", "__builtins__": builtins}, directory)
+
+
+# ---------------------------------------------------------------------------
+# Server side
+# ---------------------------------------------------------------------------
+
+
+class KernelError(Exception):
+    """The kernel process died or could not be reached"""
+
+
+def _kill_group(pid: int):
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+class Kernel:
+    """A persistent interpreter for one request's generated script.
+
+    The script runs as cells, one per top-level statement. The state after
+    expensive cells is kept in a few paused forked processes, so when a fix
+    changes the script only the cells from the last snapshot before the first
+    changed statement on are executed again; data loaded by earlier cells is
+    reused. Once a cell uses DuckDB no further snapshots are taken.
+    """
+
+    def __init__(self, workspace_dir: str):
+        self.workspace_dir = workspace_dir
+        self.directory = os.path.join(workspace_dir, KERNEL_DIR)
+        self.pid: Optional[int] = None
+        # Only set when the kernel had to start as its own interpreter
+        self.proc: Optional[subprocess.Popen] = None
+        self.script: Optional[str] = None
+        self.cells: List[str] = []
+        # Cells executed -> pid of the paused process holding that state
+        self.snapshots: Dict[int, int] = {}
+        self.emitted_cell: Optional[int] = None
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.pid is not None:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            # Forking a warm worker skips the interpreter start and library preload
+            pid = worker_pool.pool.start_kernel(self.directory, self.workspace_dir)
+            if pid is None:
+                pid = self._start_cold()
+            if self.closed:
+                # Closed while starting up in the background
+                _kill_group(pid)
+                raise KernelError("Kernel was closed")
+            self.pid = pid
+            self.snapshots = {0: pid}
+
+    def _start_cold(self) -> int:
+        self.proc = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), self.directory, self.workspace_dir],
+            stdout=subprocess.PIPE,
+            text=True,
+            start_new_session=True,
+        )
+        line = self.proc.stdout.readline()
+        if not line or not json.loads(line).get("ready"):
+            self.proc.kill()
+            raise KernelError(f"Kernel failed to start (exit code {self.proc.poll()})")
+        return self.proc.pid
+
+    def alive(self) -> bool:
+        if self.proc is not None:
+            return self.proc.poll() is None
+        return self.pid is not None and _pid_alive(self.pid)
+
+    def _discard(self, after: int):
+        """Drop snapshots holding state past `after` cells"""
+        for cells_done in [n for n in self.snapshots if n > after]:
+            try:
+                os.kill(self.snapshots.pop(cells_done), signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+            try:
+                os.unlink(_socket_path(self.directory, cells_done))
+            except FileNotFoundError:
+                pass
+
+    def run(
+        self, script: str, timeout: float = 120, handle: Optional[worker_pool.ScriptHandle] = None
+    ) -> subprocess.CompletedProcess:
+        """Run a script like worker_pool.run_script, resuming from the longest
+        unchanged prefix of the previously run version of it."""
+        with open(script, encoding="utf-8") as f:
+            cells = split_cells(f.read())
+        self.start()
+        if not self.alive():
+            raise KernelError("Kernel process is not running")
+
+        if script != self.script:
+            self.cells = []
+        unchanged = 0
+        while unchanged < min(len(cells), len(self.cells)) and cells[unchanged] == self.cells[unchanged]:
+            unchanged += 1
+        start = max(n for n in self.snapshots if n <= unchanged)
+        self._discard(after=start)
+        if self.emitted_cell is not None and self.emitted_cell >= start:
+            # The answer came from a cell that runs again
+            result_path = os.path.join(self.workspace_dir, sandbox_harness.RESULT_FILE)
+            if os.path.exists(result_path):
+                os.unlink(result_path)
+            self.emitted_cell = None
+        for index in range(start, len(cells)):
+            for stream in ("out", "err"):
+                try:
+                    os.unlink(_cell_output(self.directory, index, stream))
+                except FileNotFoundError:
+                    pass
+        self.script, self.cells = script, cells
+        print(f"🧩 Kernel: reusing state of {start}/{len(cells)} cells, running {len(cells) - start}")
+
+        handle = handle or worker_pool.ScriptHandle()
+        conn = socket.socket(socket.AF_UNIX)
+        try:
+            conn.connect(_socket_path(self.directory, start))
+            _send(
+                conn,
+                {
+                    "script": script,
+                    "start": start,
+                    "snapshots": KERNEL_MAX_SNAPSHOTS - (len(self.snapshots) - 1),
+                },
+            )
+        except OSError as e:
+            conn.close()
+            raise KernelError(f"Could not reach kernel snapshot {start}: {e}")
+
+        monitor = None
+        cells_done = start
+        started = time.time()
+        returncode = None
+        timed_out = False
+        buffer = b""
+        try:
+            while returncode is None:
+                if time.time() - started > timeout:
+                    timed_out = True
+                    handle.cancel()
+                    break
+                if monitor is not None and not monitor.sample():
+                    handle.cancel()
+                    break
+                readable, _, _ = select.select([conn], [], [], 0.01)
+                if not readable:
+                    continue
+                data = conn.recv(65536)
+                if not data:
+                    # The runner died without reporting back
+                    break
+                buffer += data
+                while b"\n" in buffer:
+                    line, buffer = buffer.split(b"\n", 1)
+                    message = json.loads(line)
+                    if "pid" in message and "snapshot" not in message:
+                        handle.started(message["pid"])
+                        monitor = sandbox_limits.ProcessMonitor(message["pid"])
+                    elif "snapshot" in message:
+                        self.snapshots[message["snapshot"]] = message["pid"]
+                    elif "ran" in message:
+                        cells_done = message["ran"]
+                    elif "emitted" in message:
+                        self.emitted_cell = message["emitted"]
+                    elif "done" in message:
+                        returncode = message["done"]
+        finally:
+            handle.finished()
+            conn.close()
+
+        if returncode is None:
+            returncode = -signal.SIGKILL
+        stdout, stderr = [], []
+        for index in range(min(cells_done + 1, len(cells))):
+            for stream, parts in (("out", stdout), ("err", stderr)):
+                try:
+                    with open(_cell_output(self.directory, index, stream), encoding="utf-8", errors="replace") as f:
+                        parts.append(f.read())
+                except FileNotFoundError:
+                    pass
+        stderr = "".join(stderr)
+        kill_reason = monitor.killed_reason if monitor is not None else None
+        if kill_reason:
+            stderr += f"\n{kill_reason}\n"
+        if monitor is not None:
+            perf = monitor.finish(time.time() - started)
+        else:
+            perf = {"wall_time": round(time.time() - started, 3), "cpu_time": 0.0, "peak_rss_mb": 0.0, "bytes_written": 0}
+        perf["cells_reused"] = start
+        perf["cells_run"] = min(cells_done + 1, len(cells)) - start
+        return worker_pool._completed(
+            script,
+            timeout,
+            {
+                "returncode": returncode,
+                "stdout": "".join(stdout),
+                "stderr": stderr,
+                "timed_out": timed_out,
+                "perf": perf,
+            },
+        )
+
+    def close(self):
+        self.closed = True
+        self._discard(after=0)
+        if self.pid is not None:
+            # Also takes any snapshot a killed runner forked but never reported
+            _kill_group(self.pid)
+        if self.proc is not None:
+            try:
+                self.proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                pass
+
+
+class KernelManager:
+    """One kernel per request workspace, started ahead of the first run"""
+
+    def __init__(self):
+        self._kernels: Dict[str, Kernel] = {}
+        self._lock = threading.Lock()
+
+    def get(self, workspace_dir: str) -> Kernel:
+        with self._lock:
+            if workspace_dir not in self._kernels:
+                self._kernels[workspace_dir] = Kernel(workspace_dir)
+            return self._kernels[workspace_dir]
+
+    def prestart(self, workspace_dir: str):
+        """Start the workspace's kernel in the background while code is generated"""
+        if not ANALYSIS_KERNEL:
+            return
+        kernel = self.get(workspace_dir)
+
+        def target():
+            try:
+                kernel.start()
+            except Exception as e:
+                if not kernel.closed:
+                    print(f"⚠️ Failed to start analysis kernel: {e}")
+
+        threading.Thread(target=target, daemon=True).start()
+
+    def close(self, workspace_dir: str):
+        with self._lock:
+            kernel = self._kernels.pop(workspace_dir, None)
+        if kernel is not None:
+            kernel.close()
+
+    def close_all(self):
+        for workspace_dir in list(self._kernels):
+            self.close(workspace_dir)
+
+
+kernels = KernelManager()
+
+
+def run_script(
+    script: str,
+    cwd: Optional[str] = None,
+    timeout: float = 120,
+    handle: Optional[worker_pool.ScriptHandle] = None,
+) -> subprocess.CompletedProcess:
+    """worker_pool.run_script through the workspace's kernel, falling back to a
+    fresh run when the kernel is disabled or cannot run the script"""
+    cwd = cwd or os.getcwd()
+    if ANALYSIS_KERNEL:
+        try:
+            return kernels.get(cwd).run(script, timeout, handle)
+        except SyntaxError:
+            # Let the interpreter report it with its usual message
+            pass
+        except (KernelError, OSError, ValueError) as e:
+            print(f"⚠️ Analysis kernel failed, running script fresh: {e}")
+            kernels.close(cwd)
+    return worker_pool.run_script(script, cwd, timeout, handle)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], sys.argv[2])
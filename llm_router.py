@@ -0,0 +1,397 @@
+import asyncio
+import json
+import os
+import random
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+from dotenv import load_dotenv
+
+import http_clients
+
+load_dotenv()
+
+GEMINI_PRO_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-pro:generateContent"
+GEMINI_FLASH_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
+OPENAI_URL = "https://aipipe.org/openai/v1/chat/completions"
+OPENAI_MODEL = "openai/gpt-oss-20b:free"
+
+EWMA_ALPHA = float(os.getenv("LLM_EWMA_ALPHA", "0.3"))
+BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1.0"))
+BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "20.0"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("LLM_CIRCUIT_FAILURES", "3"))
+CIRCUIT_COOLDOWN = float(os.getenv("LLM_CIRCUIT_COOLDOWN", "30"))
+HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "5"))
+# Used as the hedge trigger until an endpoint has enough samples for a p90
+HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "30"))
+HEDGING_ENABLED = os.getenv("LLM_HEDGING", "1") != "0"
+PREFERENCE_WEIGHT = float(os.getenv("LLM_PREFERENCE_WEIGHT", "0.5"))
+
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+class ProviderError(Exception):
+    """A failed call to one endpoint, with the server's Retry-After hint if any"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+class Endpoint:
+    """One LLM endpoint plus its latency/error statistics and circuit breaker"""
+
+    def __init__(self, name: str, provider: str, url: str, api_style: str):
+        self.name = name
+        self.provider = provider
+        self.url = url
+        self.api_style = api_style
+        self.ewma_latency: Optional[float] = None
+        self.ewma_error = 0.0
+        self.latencies = deque(maxlen=50)
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+    def build_request(
+        self, question_text: str, relevant_context: str, prefix=None, temperature=None
+    ):
+        """Return (headers, payload) in this endpoint's wire format.
+
+        With a prompt_cache.PromptPrefix, a provider cache handle registered for
+        this model is referenced instead of resending the prefix; otherwise the
+        prefix is inlined ahead of question_text. A temperature overrides the
+        provider's default sampling temperature.
+        """
+        headers, payload = self._build_request(question_text, relevant_context, prefix)
+        if temperature is not None:
+            if self.api_style == "gemini":
+                payload["generationConfig"] = {"temperature": temperature}
+            else:
+                payload["temperature"] = temperature
+        return headers, payload
+
+    def _build_request(self, question_text: str, relevant_context: str, prefix=None):
+        if prefix is not None:
+            handle = prefix.handle_for(self.name) if self.api_style == "gemini" else None
+            if handle:
+                headers = {
+                    "Content-Type": "application/json",
+                    "X-goog-api-key": os.getenv("gemini_api") or "",
+                }
+                payload = {
+                    "cachedContent": handle,
+                    "contents": [{"role": "user", "parts": [{"text": question_text}]}],
+                }
+                return headers, payload
+            relevant_context = prefix.system_text
+            question_text = prefix.text + "\n\n" + question_text
+
+        if self.api_style == "gemini":
+            headers = {
+                "Content-Type": "application/json",
+                "X-goog-api-key": os.getenv("gemini_api") or "",
+            }
+            payload = {
+                "contents": [
+                    {"parts": [{"text": relevant_context}, {"text": question_text}]}
+                ]
+            }
+        else:
+            headers = {
+                "Authorization": f"Bearer {os.getenv('API_KEY')}",
+                "Content-Type": "application/json",
+            }
+            payload = {
+                "model": OPENAI_MODEL,
+                "messages": [
+                    {"role": "system", "content": relevant_context},
+                    {"role": "user", "content": question_text},
+                ],
+            }
+        return headers, payload
+
+    def build_stream_request(self, question_text: str, relevant_context: str, prefix=None):
+        """Return (url, headers, payload) for this endpoint's server-sent-events API"""
+        headers, payload = self.build_request(question_text, relevant_context, prefix)
+        if self.api_style == "gemini":
+            url = self.url.replace(":generateContent", ":streamGenerateContent") + "?alt=sse"
+        else:
+            url = self.url
+            payload = dict(payload, stream=True)
+        return url, headers, payload
+
+    def parse_stream_event(self, data: str) -> str:
+        """Extract the text delta from one SSE data payload"""
+        event = json.loads(data)
+        if self.api_style == "gemini":
+            parts = (event.get("candidates") or [{}])[0].get("content", {}).get("parts", [])
+            return "".join(part.get("text", "") for part in parts)
+        choices = event.get("choices") or [{}]
+        return choices[0].get("delta", {}).get("content") or ""
+
+    def is_available(self, now: float) -> bool:
+        # After the cooldown the breaker is half-open and lets traffic through;
+        # the next failure re-opens it immediately
+        return now >= self.open_until
+
+    def p90(self) -> Optional[float]:
+        if len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))]
+
+    def score(self) -> float:
+        """Expected cost of sending a request here; lower is better"""
+        latency = self.ewma_latency if self.ewma_latency is not None else HEDGE_DEFAULT_DELAY
+        return latency * (1 + 4 * self.ewma_error)
+
+    def record_success(self, latency: float):
+        self.latencies.append(latency)
+        if self.ewma_latency is None:
+            self.ewma_latency = latency
+        else:
+            self.ewma_latency = EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.ewma_latency
+        self.ewma_error = (1 - EWMA_ALPHA) * self.ewma_error
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+    def record_failure(self):
+        self.ewma_error = EWMA_ALPHA + (1 - EWMA_ALPHA) * self.ewma_error
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= CIRCUIT_FAILURE_THRESHOLD:
+            self.open_until = time.monotonic() + CIRCUIT_COOLDOWN
+            print(f"🚫 Circuit open for {self.name} for {CIRCUIT_COOLDOWN:.0f}s")
+
+    def snapshot(self) -> dict:
+        return {
+            "ewma_latency": self.ewma_latency,
+            "ewma_error": round(self.ewma_error, 3),
+            "p90": self.p90(),
+            "circuit_open": not self.is_available(time.monotonic()),
+        }
+
+
+class LLMRouter:
+    """Routes LLM calls across endpoints with backoff, circuit breaking and hedging"""
+
+    def __init__(self, endpoints: List[Endpoint]):
+        self.endpoints: Dict[str, Endpoint] = {e.name: e for e in endpoints}
+
+    def rank(self, names: List[str]) -> List[Endpoint]:
+        """Order endpoints by score, skipping open circuits unless all are open"""
+        now = time.monotonic()
+        candidates = [self.endpoints[n] for n in names]
+        available = [e for e in candidates if e.is_available(now)]
+        if not available:
+            # Everything is tripped: try whichever breaker closes first
+            return [min(candidates, key=lambda e: e.open_until)]
+        # Callers list endpoints in order of preference (e.g. strongest model
+        # first); an endpoint only loses its place when it is clearly slower or
+        # failing compared to the ones behind it
+        order = {e.name: i for i, e in enumerate(candidates)}
+        return sorted(
+            available,
+            key=lambda e: e.score() * (1 + PREFERENCE_WEIGHT * order[e.name]),
+        )
+
+    async def call(
+        self,
+        names: List[str],
+        question_text: str,
+        relevant_context: str = "",
+        max_tries: int = 3,
+        timeout: float = 60,
+        prefix=None,
+        temperature: Optional[float] = None,
+    ) -> dict:
+        _, result = await self.call_with_endpoint(
+            names, question_text, relevant_context, max_tries, timeout, prefix, temperature
+        )
+        return result
+
+    async def call_with_endpoint(
+        self,
+        names: List[str],
+        question_text: str,
+        relevant_context: str = "",
+        max_tries: int = 3,
+        timeout: float = 60,
+        prefix=None,
+        temperature: Optional[float] = None,
+    ) -> Tuple[Optional[Endpoint], dict]:
+        """Like call(), also returning the endpoint that answered (None on failure),
+        which differs from the preferred one when a hedge or a retry won"""
+        for attempt in range(max_tries):
+            ranked = self.rank(names)
+            try:
+                return await self._hedged_call(
+                    ranked, question_text, relevant_context, timeout, prefix, temperature
+                )
+            except Exception as e:
+                print(f"Error during LLM call ({ranked[0].name}, try {attempt + 1}): {e}")
+                if attempt + 1 >= max_tries:
+                    break
+                delay = getattr(e, "retry_after", None)
+                if delay is None:
+                    # Full jitter exponential backoff
+                    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+                # A server may ask for minutes; never stall a request longer than the cap
+                await asyncio.sleep(min(delay, BACKOFF_MAX))
+        return None, {"error": f"{names[0]} failed after max retries"}
+
+    async def _hedged_call(
+        self,
+        ranked: List[Endpoint],
+        question_text: str,
+        relevant_context: str,
+        timeout: float,
+        prefix=None,
+        temperature: Optional[float] = None,
+    ) -> Tuple[Endpoint, dict]:
+        primary = ranked[0]
+        secondary = ranked[1] if HEDGING_ENABLED and len(ranked) > 1 else None
+        tasks = {
+            asyncio.ensure_future(
+                self._send(
+                    primary, question_text, relevant_context, timeout, prefix, temperature
+                )
+            ): primary
+        }
+        hedged = False
+        try:
+            if secondary is not None:
+                hedge_delay = primary.p90() or HEDGE_DEFAULT_DELAY
+                done, _ = await asyncio.wait(tasks, timeout=min(hedge_delay, timeout))
+                if not done:
+                    print(f"⏱️ {primary.name} passed {hedge_delay:.1f}s, hedging with {secondary.name}")
+                    tasks[
+                        asyncio.ensure_future(
+                            self._send(
+                                secondary, question_text, relevant_context, timeout,
+                                prefix, temperature,
+                            )
+                        )
+                    ] = secondary
+                    hedged = True
+
+            last_error = None
+            while tasks:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    endpoint = tasks.pop(task)
+                    if task.exception() is None:
+                        if hedged:
+                            print(f"🏁 {endpoint.name} answered first")
+                        return endpoint, task.result()
+                    last_error = task.exception()
+            raise last_error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _send(
+        self,
+        endpoint: Endpoint,
+        question_text: str,
+        relevant_context: str,
+        timeout: float,
+        prefix=None,
+        temperature: Optional[float] = None,
+    ) -> dict:
+        headers, payload = endpoint.build_request(
+            question_text, relevant_context, prefix, temperature
+        )
+        client = http_clients.get_client(endpoint.provider)
+        started = time.monotonic()
+        try:
+            response = await client.post(endpoint.url, headers=headers, json=payload, timeout=timeout)
+            if response.status_code in RETRYABLE_STATUS:
+                raise ProviderError(
+                    f"{endpoint.name} returned HTTP {response.status_code}",
+                    retry_after=_parse_retry_after(response.headers.get("Retry-After")),
+                )
+            response.raise_for_status()
+            if not response.text.strip():
+                raise ProviderError(f"Empty response from {endpoint.name}")
+            result = response.json()
+        except asyncio.CancelledError:
+            # A hedge loser is not an endpoint failure
+            raise
+        except (httpx.HTTPError, ValueError, ProviderError):
+            endpoint.record_failure()
+            raise
+        endpoint.record_success(time.monotonic() - started)
+        return result
+
+    async def stream(
+        self,
+        names: List[str],
+        question_text: str,
+        relevant_context: str = "",
+        timeout: float = 120,
+        prefix=None,
+    ) -> AsyncIterator[str]:
+        """Stream text deltas from the best available endpoint.
+
+        Streams are not hedged or retried: once tokens have been handed to the
+        caller they cannot be taken back, so callers fall back to `call` on error.
+        """
+        endpoint = self.rank(names)[0]
+        url, headers, payload = endpoint.build_stream_request(
+            question_text, relevant_context, prefix
+        )
+        client = http_clients.get_client(endpoint.provider)
+        started = time.monotonic()
+        try:
+            async with client.stream(
+                "POST", url, headers=headers, json=payload, timeout=timeout
+            ) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    raise ProviderError(
+                        f"{endpoint.name} stream returned HTTP {response.status_code}",
+                        retry_after=_parse_retry_after(response.headers.get("Retry-After")),
+                    )
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if not data or data == "[DONE]":
+                        continue
+                    text = endpoint.parse_stream_event(data)
+                    if text:
+                        yield text
+        except asyncio.CancelledError:
+            raise
+        except (httpx.HTTPError, ValueError, ProviderError):
+            endpoint.record_failure()
+            raise
+        endpoint.record_success(time.monotonic() - started)
+
+    def stats(self) -> dict:
+        return {name: e.snapshot() for name, e in self.endpoints.items()}
+
+
+router = LLMRouter(
+    [
+        Endpoint("gemini-2.5-pro", "gemini", GEMINI_PRO_URL, "gemini"),
+        Endpoint("gemini-2.0-flash", "gemini", GEMINI_FLASH_URL, "gemini"),
+        Endpoint("openai", "openai", OPENAI_URL, "openai"),
+    ]
+)
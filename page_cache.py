@@ -0,0 +1,126 @@
+import base64
+import os
+import time
+import zlib
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+from dotenv import load_dotenv
+
+import singleflight
+from disk_cache import DiskCache, make_key
+
+load_dotenv()
+
+# Seconds a cached page is served without asking the site again
+PAGE_CACHE_FRESHNESS = float(os.getenv("PAGE_CACHE_FRESHNESS", "3600"))
+# Per-domain overrides, e.g. "en.wikipedia.org=86400,finance.yahoo.com=0";
+# a domain also covers its subdomains, and 0 revalidates on every fetch
+PAGE_CACHE_DOMAIN_FRESHNESS = os.getenv("PAGE_CACHE_DOMAIN_FRESHNESS", "")
+# Tiers a page can be cached under: the static HTML or the browser-rendered DOM
+TIERS = ("http", "browser")
+
+
+def _parse_domain_freshness(spec: str) -> Dict[str, float]:
+    freshness = {}
+    for item in spec.split(","):
+        domain, _, seconds = item.partition("=")
+        if domain.strip() and seconds.strip():
+            freshness[domain.strip().lower()] = float(seconds)
+    return freshness
+
+
+def validators(headers) -> dict:
+    """The response's ETag/Last-Modified, for revalidating it later"""
+    found = {}
+    for name in ("etag", "last-modified"):
+        value = headers.get(name)
+        if value:
+            found[name] = value
+    return found
+
+
+def conditional_headers(entry: dict) -> dict:
+    headers = {}
+    if entry["validators"].get("etag"):
+        headers["If-None-Match"] = entry["validators"]["etag"]
+    if entry["validators"].get("last-modified"):
+        headers["If-Modified-Since"] = entry["validators"]["last-modified"]
+    return headers
+
+
+class PageCache:
+    """Fetched pages, compressed on disk and keyed by URL and tier.
+
+    An entry is served as-is while fresh (per-domain freshness). After that a
+    static page is revalidated with a conditional GET using its
+    ETag/Last-Modified, so an unchanged page costs a 304 instead of a
+    download; a rendered page is rendered again, since its data does not come
+    from the document. Entries are kept for the store's TTL and evicted least
+    recently used.
+    """
+
+    def __init__(self, cache: DiskCache, freshness: float, domain_freshness: Dict[str, float]):
+        self.cache = cache
+        self.freshness = freshness
+        self.domain_freshness = domain_freshness
+
+    def freshness_for(self, url: str) -> float:
+        host = urlparse(url).netloc.lower().split(":")[0]
+        # The most specific configured domain wins
+        for domain in sorted(self.domain_freshness, key=len, reverse=True):
+            if host == domain or host.endswith("." + domain):
+                return self.domain_freshness[domain]
+        return self.freshness
+
+    @staticmethod
+    def _key(url: str, tier: str) -> str:
+        return make_key("page", singleflight.normalize_url(url), tier)
+
+    def get(self, url: str) -> Optional[dict]:
+        """The most recently fetched entry for the URL over all tiers, or None"""
+        best = None
+        for tier in TIERS:
+            stored = self.cache.get(self._key(url, tier), site=f"page_{tier}")
+            if stored is not None and (best is None or stored["fetched_at"] > best["fetched_at"]):
+                best = stored
+        if best is None:
+            return None
+        return {
+            **best,
+            "html": zlib.decompress(base64.b64decode(best["html"])).decode("utf-8"),
+        }
+
+    def is_fresh(self, entry: dict) -> bool:
+        return time.time() < entry["fresh_until"]
+
+    def put(self, url: str, tier: str, html: str, page_validators: dict):
+        now = time.time()
+        self.cache.set(
+            self._key(url, tier),
+            {
+                "url": url,
+                "tier": tier,
+                "html": base64.b64encode(zlib.compress(html.encode("utf-8"), 6)).decode("ascii"),
+                "validators": page_validators,
+                "fetched_at": now,
+                "fresh_until": now + self.freshness_for(url),
+            },
+        )
+
+    def revalidated(self, entry: dict, headers):
+        """The site answered 304: the entry is fresh again, with any new validators"""
+        self.put(entry["url"], entry["tier"], entry["html"], {**entry["validators"], **validators(headers)})
+
+
+pages = PageCache(
+    DiskCache(
+        os.getenv("PAGE_CACHE_PATH", ".cache/page_cache.sqlite3"),
+        max_entries=int(os.getenv("PAGE_CACHE_MAX_ENTRIES", "2000")),
+        max_bytes=int(os.getenv("PAGE_CACHE_MAX_MB", "128")) * 1024 * 1024,
+        default_ttl=float(os.getenv("PAGE_CACHE_TTL", str(7 * 24 * 3600))),
+        enabled=os.getenv("PAGE_CACHE_ENABLED", "1") != "0",
+    ),
+    PAGE_CACHE_FRESHNESS,
+    _parse_domain_freshness(PAGE_CACHE_DOMAIN_FRESHNESS),
+)
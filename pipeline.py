@@ -0,0 +1,104 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List
+
+
+class StageError(Exception):
+    """Raised when a pipeline stage fails; carries the stage name and cause"""
+
+    def __init__(self, stage: str, error: BaseException):
+        super().__init__(f"Stage '{stage}' failed: {error}")
+        self.stage = stage
+        self.error = error
+
+
+class Stage:
+    def __init__(self, name: str, fn: Callable[..., Awaitable[Any]], deps: Iterable[str] = ()):
+        self.name = name
+        self.fn = fn
+        self.deps = list(deps)
+
+
+class StageGraph:
+    """Runs async stages as a dependency graph on an asyncio TaskGroup.
+
+    Each stage function is called with its dependencies' results as keyword
+    arguments and starts as soon as those are available, so end-to-end latency
+    follows the critical path rather than the sum of all stages. The first
+    failure cancels the remaining stages and is re-raised as a StageError.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, Stage] = {}
+        self.timings: Dict[str, Dict[str, float]] = {}
+
+    def add(self, name: str, fn: Callable[..., Awaitable[Any]], deps: Iterable[str] = ()):
+        if name in self.stages:
+            raise ValueError(f"Duplicate stage: {name}")
+        self.stages[name] = Stage(name, fn, deps)
+        return self
+
+    def _check(self) -> List[str]:
+        """Return stage names in dependency order, rejecting unknown deps and cycles"""
+        order, state = [], {}
+
+        def visit(name: str, path: List[str]):
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError(f"Cycle in stage graph: {' -> '.join(path + [name])}")
+            if name not in self.stages:
+                raise ValueError(f"Unknown stage dependency: {name}")
+            state[name] = "visiting"
+            for dep in self.stages[name].deps:
+                visit(dep, path + [name])
+            state[name] = "done"
+            order.append(name)
+
+        for name in self.stages:
+            visit(name, [])
+        return order
+
+    async def run(self) -> Dict[str, Any]:
+        order = self._check()
+        loop = asyncio.get_running_loop()
+        futures = {name: loop.create_future() for name in order}
+        results: Dict[str, Any] = {}
+        started = time.perf_counter()
+
+        async def run_stage(stage: Stage):
+            # A failed dependency cancels the whole group, so these only resolve on success
+            kwargs = {dep: await futures[dep] for dep in stage.deps}
+            stage_start = time.perf_counter()
+            try:
+                result = await stage.fn(**kwargs)
+            except Exception as e:
+                raise StageError(stage.name, e) from e
+            finally:
+                self.timings[stage.name] = {
+                    "start": round(stage_start - started, 3),
+                    "duration": round(time.perf_counter() - stage_start, 3),
+                }
+            results[stage.name] = result
+            futures[stage.name].set_result(result)
+
+        try:
+            async with asyncio.TaskGroup() as group:
+                for name in order:
+                    group.create_task(run_stage(self.stages[name]))
+        except BaseExceptionGroup as eg:
+            errors = [e for e in eg.exceptions if isinstance(e, StageError)]
+            if not errors:
+                raise
+            raise errors[0] from None
+        finally:
+            for future in futures.values():
+                if not future.done():
+                    future.cancel()
+            self.log_timings(time.perf_counter() - started)
+        return results
+
+    def log_timings(self, total: float):
+        print(f"⏱️ Pipeline finished in {total:.2f}s")
+        for name, timing in sorted(self.timings.items(), key=lambda kv: kv[1]["start"]):
+            print(f"   {name:<12} start +{timing['start']:.2f}s  took {timing['duration']:.2f}s")
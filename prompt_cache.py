@@ -0,0 +1,148 @@
+import asyncio
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+import http_clients
+from disk_cache import make_key
+from prompt_summary import estimate_tokens
+
+load_dotenv()
+
+GEMINI_CACHE_URL = "https://generativelanguage.googleapis.com/v1beta/cachedContents"
+PROMPT_CACHE_TTL = int(os.getenv("PROMPT_CACHE_TTL", "3600"))
+# Gemini rejects explicit caches below a model-specific size (4096 tokens for 2.5-pro)
+PROMPT_CACHE_MIN_TOKENS = int(os.getenv("PROMPT_CACHE_MIN_TOKENS", "4096"))
+# Stop using a handle a little before the provider expires it
+EXPIRY_MARGIN = 60
+
+
+class PromptPrefix:
+    """The static leading part of a prompt: system message plus labelled blocks.
+
+    Calls that share a prefix differ only in their trailing text, so the prefix
+    can be registered once with the provider and referenced by handle.
+    """
+
+    def __init__(self, system_text: str, blocks: List[Tuple[str, str]]):
+        self.system_text = system_text
+        self.blocks = blocks
+        self.text = "\n\n".join(f"{label}: {body}" for label, body in blocks)
+        self.handles: Dict[str, str] = {}
+
+    def key(self, model: str) -> str:
+        return make_key(model, self.system_text, self.text)
+
+    def handle_for(self, model: str) -> Optional[str]:
+        return self.handles.get(model)
+
+
+class LocalContextCache:
+    """In-process stand-in for a provider context cache (tests, or caching disabled).
+
+    Handles are registered and reused exactly like remote ones, but requests
+    still inline the prefix text since no provider can resolve them.
+    """
+
+    remote = False
+
+    def __init__(self):
+        self.entries: Dict[str, str] = {}
+
+    async def create(self, model: str, prefix: PromptPrefix, ttl: int) -> str:
+        handle = f"local/{prefix.key(model)[:16]}"
+        self.entries[handle] = prefix.text
+        return handle
+
+
+class GeminiContextCache:
+    """Registers prefixes with the Gemini cachedContents API"""
+
+    remote = True
+
+    async def create(self, model: str, prefix: PromptPrefix, ttl: int) -> str:
+        client = http_clients.get_client("gemini")
+        response = await client.post(
+            GEMINI_CACHE_URL,
+            headers={
+                "Content-Type": "application/json",
+                "X-goog-api-key": os.getenv("gemini_api") or "",
+            },
+            json={
+                "model": f"models/{model}",
+                "systemInstruction": {"parts": [{"text": prefix.system_text}]},
+                "contents": [{"role": "user", "parts": [{"text": prefix.text}]}],
+                "ttl": f"{ttl}s",
+            },
+            timeout=60,
+        )
+        response.raise_for_status()
+        return response.json()["name"]
+
+
+class PromptCache:
+    """Maps prefix contents to provider cache handles, shared across requests"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._handles: Dict[str, Tuple[Optional[str], float]] = {}
+        self._pending: Dict[str, asyncio.Task] = {}
+
+    def lookup(self, model: str, prefix: PromptPrefix) -> Optional[str]:
+        entry = self._handles.get(prefix.key(model))
+        if entry and entry[1] > time.time():
+            return entry[0]
+        return None
+
+    async def register(self, model: str, prefix: PromptPrefix) -> Optional[str]:
+        """Return a handle for the prefix, creating the provider cache entry if needed"""
+        key = prefix.key(model)
+        entry = self._handles.get(key)
+        if entry and entry[1] > time.time():
+            handle = entry[0]
+        else:
+            prefix_tokens = estimate_tokens(prefix.system_text + prefix.text)
+            if self.backend.remote and prefix_tokens < PROMPT_CACHE_MIN_TOKENS:
+                handle = None
+            else:
+                task = self._pending.get(key)
+                if task is None:
+                    task = asyncio.ensure_future(self._create(key, model, prefix))
+                    self._pending[key] = task
+                handle = await asyncio.shield(task)
+        if handle and self.backend.remote:
+            prefix.handles[model] = handle
+        return handle
+
+    def register_in_background(self, model: str, prefix: PromptPrefix):
+        """Start registration without waiting; later calls pick the handle up"""
+        handle = self.lookup(model, prefix)
+        if handle:
+            if self.backend.remote:
+                prefix.handles[model] = handle
+            return
+        asyncio.ensure_future(self.register(model, prefix))
+
+    async def _create(self, key: str, model: str, prefix: PromptPrefix) -> Optional[str]:
+        try:
+            handle = await self.backend.create(model, prefix, PROMPT_CACHE_TTL)
+            self._handles[key] = (handle, time.time() + PROMPT_CACHE_TTL - EXPIRY_MARGIN)
+            print(f"📌 Registered {estimate_tokens(prefix.text)}-token prompt prefix as {handle}")
+            return handle
+        except Exception as e:
+            # Remember the failure so every call does not retry a doomed upload
+            print(f"⚠️ Prompt prefix caching unavailable, sending inline: {e}")
+            self._handles[key] = (None, time.time() + PROMPT_CACHE_TTL)
+            return None
+        finally:
+            self._pending.pop(key, None)
+
+
+def _default_backend():
+    backend = os.getenv("PROMPT_CACHE_BACKEND", "gemini" if os.getenv("gemini_api") else "local")
+    return GeminiContextCache() if backend == "gemini" else LocalContextCache()
+
+
+prompt_cache = PromptCache(_default_backend())
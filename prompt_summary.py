@@ -0,0 +1,177 @@
+import json
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+DEFAULT_TOKEN_BUDGET = int(os.getenv("DATA_SUMMARY_TOKEN_BUDGET", "4000"))
+
+# Progressively cheaper renderings, tried in order until one fits the budget
+DETAIL_LEVELS = [
+    {"sample_rows": 3, "cell_chars": 60, "max_columns": None},
+    {"sample_rows": 3, "cell_chars": 30, "max_columns": 40},
+    {"sample_rows": 2, "cell_chars": 24, "max_columns": 20},
+    {"sample_rows": 1, "cell_chars": 20, "max_columns": 12},
+    {"sample_rows": 0, "cell_chars": 16, "max_columns": 8},
+]
+
+STOPWORDS = {
+    "the", "and", "for", "what", "which", "how", "many", "with", "from", "that",
+    "this", "are", "was", "were", "data", "return", "answer", "json", "array",
+    "using", "each", "into", "has", "have", "its", "per", "use", "plot",
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English/code)"""
+    return (len(text) + 3) // 4
+
+
+def _question_terms(question_text: str) -> set:
+    words = re.findall(r"[a-z0-9]+", question_text.lower())
+    return {w for w in words if len(w) > 2 and w not in STOPWORDS}
+
+
+def _relevance(column: str, terms: set) -> int:
+    col_words = set(re.findall(r"[a-z0-9]+", str(column).lower()))
+    score = 2 * len(col_words & terms)
+    col_flat = re.sub(r"[^a-z0-9]", "", str(column).lower())
+    score += sum(1 for t in terms if len(t) > 3 and t in col_flat)
+    return score
+
+
+def select_columns(columns: List[str], question_text: str, max_columns: Optional[int]) -> List[str]:
+    """Keep the columns most related to the question, in their original order"""
+    if max_columns is None or len(columns) <= max_columns:
+        return list(columns)
+    terms = _question_terms(question_text)
+    ranked = sorted(
+        range(len(columns)),
+        key=lambda i: (-_relevance(columns[i], terms), i),
+    )
+    keep = set(ranked[:max_columns])
+    return [col for i, col in enumerate(columns) if i in keep]
+
+
+def _truncate(value: Any, limit: int) -> Any:
+    if value is None or isinstance(value, (bool, int)):
+        return value
+    if isinstance(value, float):
+        return None if value != value else round(value, 6)
+    text = str(value)
+    return text if len(text) <= limit else text[: limit - 1] + "…"
+
+
+def _infer_type(values: List[Any]) -> str:
+    kinds = {
+        type(v).__name__
+        for v in values
+        if v is not None and not (isinstance(v, float) and v != v)
+    } - {"NAType", "NaTType"}
+    if not kinds:
+        return "?"
+    if kinds <= {"int", "int64", "int32"}:
+        return "int"
+    if kinds <= {"int", "float", "int64", "float64"}:
+        return "float"
+    if kinds <= {"bool"}:
+        return "bool"
+    return "str"
+
+
+def _render_source(
+    label: str,
+    info: Dict[str, Any],
+    columns: List[str],
+    column_types: Dict[str, str],
+    question_text: str,
+    level: Dict[str, Any],
+) -> List[str]:
+    kept = select_columns(columns, question_text, level["max_columns"])
+    samples = info.get("sample_data") or []
+    lines = [label]
+
+    types = []
+    for col in kept:
+        col_type = column_types.get(col) or _infer_type([row.get(col) for row in samples])
+        types.append(f"{col}:{col_type}")
+    lines.append("cols: " + ", ".join(types))
+    if len(kept) < len(columns):
+        lines.append(f"(+{len(columns) - len(kept)} more columns not shown)")
+
+    if level["sample_rows"] and samples:
+        lines.append("rows:")
+        for row in samples[: level["sample_rows"]]:
+            values = [_truncate(row.get(col), level["cell_chars"]) for col in kept]
+            lines.append(json.dumps(values, ensure_ascii=False, default=str, separators=(",", ":")))
+    return lines
+
+
+def _shape(info: Dict[str, Any]) -> str:
+    shape = info.get("shape")
+    return f" ({shape[0]}x{shape[1]})" if shape else ""
+
+
+def serialize_data_summary(
+    data_summary: Dict[str, Any],
+    question_text: str = "",
+    token_budget: Optional[int] = None,
+) -> str:
+    """Render a create_data_summary() dict as compact prompt text within a token budget"""
+    token_budget = token_budget or DEFAULT_TOKEN_BUDGET
+    text = ""
+    for level in DETAIL_LEVELS:
+        text = _render_summary(data_summary, question_text, level)
+        if estimate_tokens(text) <= token_budget:
+            return text
+    # Even the smallest rendering is too large: hard cut as a last resort
+    return text[: token_budget * 4]
+
+
+def _render_summary(data_summary: Dict[str, Any], question_text: str, level: Dict[str, Any]) -> str:
+    lines = [f"{data_summary.get('total_sources', 0)} data source(s)."]
+
+    provided = data_summary.get("provided_csv")
+    if provided:
+        lines.extend(
+            _render_source(
+                f"[provided csv] {provided.get('filename')}{_shape(provided)}",
+                provided,
+                provided.get("columns", []),
+                provided.get("dtypes", {}),
+                question_text,
+                level,
+            )
+        )
+        formatted = (provided.get("formatting_applied") or {}).get("formatted_columns", [])
+        if formatted:
+            lines.append(
+                "numeric-cleaned: "
+                + ", ".join(f"{f['column']}({f['type']}->{f['target_dtype']})" for f in formatted)
+            )
+
+    for scraped in data_summary.get("scraped_data", []):
+        lines.extend(
+            _render_source(
+                f"[scraped csv] {scraped.get('filename')}{_shape(scraped)} from {scraped.get('source_url')}",
+                scraped,
+                scraped.get("columns", []),
+                scraped.get("dtypes", {}),
+                question_text,
+                level,
+            )
+        )
+
+    for db in data_summary.get("database_files", []):
+        schema = db.get("schema", {})
+        lines.extend(
+            _render_source(
+                f"[{db.get('format')} database] {db.get('source_url')} - {db.get('description', '')}",
+                db,
+                schema.get("columns", []),
+                schema.get("column_types", {}),
+                question_text,
+                level,
+            )
+        )
+
+    return "\n".join(lines)
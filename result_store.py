@@ -0,0 +1,82 @@
+import hashlib
+import os
+import subprocess
+from typing import Iterable, Optional
+
+from dotenv import load_dotenv
+
+from disk_cache import DiskCache, make_key
+
+load_dotenv()
+
+
+def fingerprint_file(path: str) -> str:
+    """Content hash of a local input file"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def execution_key(code: str, data_paths: Iterable[str], workspace_dir: str = "") -> str:
+    """Key a script run by its code and the content of the local files it may read.
+
+    The request's workspace path is normalised out of the code so the same
+    program over the same data matches across requests. Remote sources are
+    only represented by their URL in the code; the store's TTL bounds how
+    stale their results can get.
+    """
+    if workspace_dir:
+        code = code.replace(workspace_dir, "<workspace>")
+    fingerprints = sorted(
+        (os.path.basename(path), fingerprint_file(path))
+        for path in data_paths
+        if os.path.isfile(path)
+    )
+    return make_key("execution", code, fingerprints)
+
+
+class ResultStore:
+    """Successful script runs, reused when the same code meets the same data"""
+
+    def __init__(self, cache: DiskCache):
+        self.cache = cache
+
+    def get(self, key: str) -> Optional[subprocess.CompletedProcess]:
+        cached = self.cache.get(key, site="execution")
+        if cached is None:
+            return None
+        result = subprocess.CompletedProcess(
+            cached["args"], cached["returncode"], cached["stdout"], cached["stderr"]
+        )
+        result.emitted = cached.get("emitted")
+        result.perf = {**(cached.get("perf") or {}), "cached": True}
+        return result
+
+    def put(self, key: str, result: subprocess.CompletedProcess):
+        # Failures may be transient (timeouts, network); only successes are shared
+        if result.returncode != 0:
+            return
+        self.cache.set(
+            key,
+            {
+                "args": [str(arg) for arg in result.args],
+                "returncode": result.returncode,
+                "stdout": result.stdout,
+                "stderr": result.stderr,
+                "emitted": getattr(result, "emitted", None),
+                "perf": getattr(result, "perf", None),
+            },
+        )
+
+
+execution_results = ResultStore(
+    DiskCache(
+        os.getenv("EXEC_CACHE_PATH", ".cache/exec_cache.sqlite3"),
+        max_entries=int(os.getenv("EXEC_CACHE_MAX_ENTRIES", "1000")),
+        max_bytes=int(os.getenv("EXEC_CACHE_MAX_MB", "256")) * 1024 * 1024,
+        default_ttl=float(os.getenv("EXEC_CACHE_TTL", "3600")),
+        enabled=os.getenv("EXEC_CACHE_ENABLED", "1") != "0",
+    )
+)
@@ -0,0 +1,119 @@
+# Result channel between generated scripts and the server: scripts hand their
+# answer to emit_result(), which writes a compact binary frame that the server
+# decodes with read_result(), leaving stdout for logs only
+
+import base64
+import builtins
+import datetime
+import decimal
+import json
+import math
+import os
+import sys
+
+import table_store
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - msgpack is in requirements.txt
+    msgpack = None
+
+RESULT_FILE = ".result.bin"
+# One-byte frame header naming the encoding of the payload that follows
+MSGPACK_FRAME = b"M"
+JSON_FRAME = b"J"
+
+
+def _plain(obj):
+    """Convert numpy/pandas/datetime values that the encoders cannot handle"""
+    if hasattr(obj, "to_dict") and hasattr(obj, "columns"):
+        return obj.to_dict("records")
+    if hasattr(obj, "tolist"):
+        # numpy arrays and scalars, pandas Series and Index
+        return obj.tolist()
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if type(obj).__name__ in ("NAType", "NaTType"):
+        return None
+    if hasattr(obj, "isoformat"):
+        return obj.isoformat()
+    raise TypeError(f"Cannot emit value of type {type(obj).__name__}")
+
+
+def encode(obj) -> bytes:
+    if msgpack is not None:
+        return MSGPACK_FRAME + msgpack.packb(obj, default=_plain, use_bin_type=True)
+    return JSON_FRAME + json.dumps(obj, default=_plain).encode("utf-8")
+
+
+def decode(data: bytes):
+    frame, payload = data[:1], data[1:]
+    if frame == MSGPACK_FRAME:
+        # Results are often keyed by year or count (value_counts().to_dict());
+        # _json_safe turns the keys into strings for the response
+        return msgpack.unpackb(payload, raw=False, strict_map_key=False)
+    if frame == JSON_FRAME:
+        return json.loads(payload)
+    raise ValueError(f"Unknown result frame {frame!r}")
+
+
+def install(result_path: str = None):
+    """Expose emit_result() and the table loaders to the script about to run,
+    and clear any stale result"""
+    result_path = os.path.abspath(
+        result_path or os.getenv("SANDBOX_RESULT_PATH") or RESULT_FILE
+    )
+    if os.path.exists(result_path):
+        os.unlink(result_path)
+
+    def emit_result(obj):
+        data = encode(obj)
+        tmp_path = result_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, result_path)
+
+    builtins.emit_result = emit_result
+    table_store.install()
+
+
+def _json_safe(value):
+    # NaN/inf cannot go into the JSON response; report them as null
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, dict):
+        return {str(k): _json_safe(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_json_safe(v) for v in value]
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode("ascii")
+    return value
+
+
+def read_result(directory: str):
+    """Return the result a script emitted in `directory`, or None if it emitted none"""
+    path = os.path.join(directory, RESULT_FILE)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    return _json_safe(decode(data))
+
+
+if __name__ == "__main__":
+    import runpy
+
+    import sandbox_limits
+
+    script = sys.argv[1]
+    # The cold path: limits are set here, since preexec_fn is unsafe in a threaded server
+    sandbox_limits.apply_limits()
+    install()
+    sys.argv = sys.argv[1:]
+    sys.path[0] = os.path.dirname(os.path.abspath(script))
+    runpy.run_path(script, run_name="__main__")
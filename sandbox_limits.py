@@ -0,0 +1,129 @@
+import os
+import resource
+import signal
+import time
+from typing import Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Hard limits applied inside each script process (0 disables a limit)
+SCRIPT_MAX_MEMORY_MB = int(os.getenv("SCRIPT_MAX_MEMORY_MB", "8192"))  # RLIMIT_AS
+SCRIPT_CPU_SECONDS = int(os.getenv("SCRIPT_CPU_SECONDS", "120"))  # RLIMIT_CPU
+SCRIPT_MAX_OPEN_FILES = int(os.getenv("SCRIPT_MAX_OPEN_FILES", "1024"))  # RLIMIT_NOFILE
+# Resident memory at which the supervisor kills a script before it hurts the host
+SCRIPT_MAX_RSS_MB = int(os.getenv("SCRIPT_MAX_RSS_MB", "4096"))
+# Add resource usage to the API response as "_perf" (always logged); set to 0
+# for clients that reject unknown keys in the answer
+EXECUTION_PERF_IN_RESPONSE = os.getenv("EXECUTION_PERF_IN_RESPONSE", "1") == "1"
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def _limit(kind: int, soft: int, hard: Optional[int] = None):
+    _, current_hard = resource.getrlimit(kind)
+    hard = hard if hard is not None else soft
+    if current_hard != resource.RLIM_INFINITY:
+        soft, hard = min(soft, current_hard), min(hard, current_hard)
+    resource.setrlimit(kind, (soft, hard))
+
+
+def apply_limits():
+    """Restrict the calling process; run in the script process before user code"""
+    if SCRIPT_MAX_MEMORY_MB:
+        _limit(resource.RLIMIT_AS, SCRIPT_MAX_MEMORY_MB * 1024 * 1024)
+    if SCRIPT_CPU_SECONDS:
+        # SIGXCPU at the soft limit, SIGKILL a few seconds later
+        _limit(resource.RLIMIT_CPU, SCRIPT_CPU_SECONDS, SCRIPT_CPU_SECONDS + 5)
+    if SCRIPT_MAX_OPEN_FILES:
+        _limit(resource.RLIMIT_NOFILE, SCRIPT_MAX_OPEN_FILES)
+
+
+class ProcessMonitor:
+    """Samples a running script's memory and collects its resource usage"""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.peak_rss = 0
+        self.cpu_time = 0.0
+        self.bytes_written = 0
+        self.killed_reason = None
+
+    def sample(self) -> bool:
+        """Record current RSS (and CPU/IO as a fallback); False once over the RSS limit"""
+        try:
+            with open(f"/proc/{self.pid}/statm") as f:
+                rss = int(f.read().split()[1]) * PAGE_SIZE
+            with open(f"/proc/{self.pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            self.cpu_time = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        except (OSError, IndexError, ValueError):
+            return True
+        self.peak_rss = max(self.peak_rss, rss)
+        self.sample_io()
+        if SCRIPT_MAX_RSS_MB and rss > SCRIPT_MAX_RSS_MB * 1024 * 1024:
+            self.killed_reason = (
+                f"Killed: resident memory {rss // (1024 * 1024)} MB exceeded "
+                f"the {SCRIPT_MAX_RSS_MB} MB limit. Filter or aggregate the data "
+                f"in SQL instead of loading it all into memory."
+            )
+            return False
+        return True
+
+    def sample_io(self):
+        # Readable until the process is reaped, so also valid for a zombie
+        try:
+            with open(f"/proc/{self.pid}/io") as f:
+                for line in f:
+                    if line.startswith("wchar:"):
+                        self.bytes_written = int(line.split()[1])
+        except (OSError, ValueError):
+            pass
+
+    def finish(self, wall_time: float, rusage=None) -> dict:
+        if rusage is not None:
+            # ru_maxrss is in kilobytes on Linux
+            self.peak_rss = max(self.peak_rss, rusage.ru_maxrss * 1024)
+            self.cpu_time = rusage.ru_utime + rusage.ru_stime
+        return {
+            "wall_time": round(wall_time, 3),
+            "cpu_time": round(self.cpu_time, 3),
+            "peak_rss_mb": round(self.peak_rss / (1024 * 1024), 1),
+            "bytes_written": self.bytes_written,
+        }
+
+
+def format_perf(perf: dict) -> str:
+    return (
+        f"peak RSS {perf['peak_rss_mb']} MB, CPU {perf['cpu_time']:.2f}s, "
+        f"wall {perf['wall_time']:.2f}s, wrote {perf['bytes_written'] / 1024:.0f} KB"
+    )
+
+
+def supervise(pid: int, timeout: float) -> Tuple[int, bool, Optional[str], dict]:
+    """Wait for a script process, enforcing the wall-clock and RSS limits.
+
+    The process must lead its own process group so the whole group can be
+    killed. Returns (returncode, timed_out, kill_reason, perf).
+    """
+    monitor = ProcessMonitor(pid)
+    started = time.time()
+    timed_out = False
+    # WNOWAIT leaves the exited process unreaped so its /proc entry stays readable
+    while os.waitid(os.P_PID, pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is None:
+        if time.time() - started > timeout:
+            timed_out = True
+        elif monitor.sample():
+            time.sleep(0.01)
+            continue
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        os.waitid(os.P_PID, pid, os.WEXITED | os.WNOWAIT)
+        break
+    monitor.sample_io()
+    _, status, rusage = os.wait4(pid, 0)
+    perf = monitor.finish(time.time() - started, rusage)
+    return os.waitstatus_to_exitcode(status), timed_out, monitor.killed_reason, perf
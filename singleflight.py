@@ -0,0 +1,52 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+from urllib.parse import urlsplit, urlunsplit
+
+
+def normalize_url(url: str) -> str:
+    """Normalize a URL so trivially different spellings coalesce to one key"""
+    url = url.strip()
+    parts = urlsplit(url)
+    if not parts.scheme:
+        return url
+    return urlunsplit(
+        (parts.scheme.lower(), parts.netloc.lower(), parts.path or "/", parts.query, "")
+    )
+
+
+class SingleFlight:
+    """Coalesce concurrent calls that share a key into a single execution.
+
+    The first caller for a key starts the work as a task; callers arriving while
+    it is still running await the same task instead of repeating the call.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.coalesced = 0
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    async def do(self, key: str, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _t, key=key: self._forget(key, _t))
+        else:
+            self.coalesced += 1
+            print(f"🔗 Coalesced duplicate {self.name} call ({self.coalesced} so far)")
+        # Shield so one cancelled caller does not cancel the shared work for the others
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception as retrieved in case every waiter was cancelled
+        if not task.cancelled():
+            task.exception()
+
+
+llm_calls = SingleFlight("LLM")
+page_fetches = SingleFlight("page fetch")
+scrapes = SingleFlight("scrape")
+schema_probes = SingleFlight("schema probe")
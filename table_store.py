@@ -0,0 +1,177 @@
+# Cleaned tables are also published as Arrow IPC files beside the request's
+# CSVs, so scripts memory-map them instead of parsing CSV on every run:
+# load_arrow() returns the mapped table without copying, load_table() converts
+# it into an ordinary (copied, writable) DataFrame, and pd.read_csv() of a
+# published CSV is served like load_table()
+
+import asyncio
+import builtins
+import functools
+import os
+import sys
+from typing import Iterable, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ARROW_TABLES = os.getenv("ARROW_TABLES", "1") != "0"
+TABLES_DIR = ".tables"
+# read_csv() keyword arguments that do not change what is parsed
+SHIM_SAFE_KWARGS = {"encoding", "low_memory", "engine"}
+
+
+def available() -> bool:
+    if not ARROW_TABLES:
+        return False
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def arrow_path(csv_path: str) -> str:
+    # Resolve links so workspace subdirectories share the published tables
+    real = os.path.realpath(csv_path)
+    return os.path.join(os.path.dirname(real), TABLES_DIR, os.path.basename(real) + ".arrow")
+
+
+def _source_stamp(csv_path: str) -> dict:
+    stat = os.stat(os.path.realpath(csv_path))
+    return {
+        b"source_size": str(stat.st_size).encode(),
+        b"source_mtime_ns": str(stat.st_mtime_ns).encode(),
+    }
+
+
+def publish(csv_path: str) -> Optional[str]:
+    """Parse a saved CSV once with pd.read_csv() and write the frame as an
+    uncompressed Arrow IPC file that scripts can memory-map"""
+    if not available():
+        return None
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+
+    try:
+        table = pa.Table.from_pandas(pd.read_csv(csv_path), preserve_index=False)
+        table = table.replace_schema_metadata(
+            {**(table.schema.metadata or {}), **_source_stamp(csv_path)}
+        )
+        path = arrow_path(csv_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with pa.OSFile(tmp_path, "wb") as sink, ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(f"⚠️ Could not publish Arrow table for {csv_path}: {e}")
+        return None
+    print(f"🏹 Published {os.path.basename(csv_path)} as Arrow ({table.num_rows} rows)")
+    return path
+
+
+async def publish_all(paths: Iterable[str]) -> List[str]:
+    csv_paths = [p for p in paths if p.lower().endswith(".csv") and os.path.isfile(p)]
+    published = await asyncio.gather(*(asyncio.to_thread(publish, p) for p in csv_paths))
+    return [p for p in published if p]
+
+
+# ---------------------------------------------------------------------------
+# Sandbox side
+# ---------------------------------------------------------------------------
+
+
+def _mapped(csv_path: str):
+    """The CSV's published table, memory-mapped, or None if missing or stale"""
+    path = arrow_path(csv_path)
+    if not os.path.exists(path):
+        return None
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+
+    table = ipc.open_file(pa.memory_map(path)).read_all()
+    try:
+        stamp = _source_stamp(csv_path)
+    except FileNotFoundError:
+        return None
+    metadata = table.schema.metadata or {}
+    if any(metadata.get(key) != value for key, value in stamp.items()):
+        return None
+    return table
+
+
+def _to_pandas(table):
+    """The DataFrame pd.read_csv() gave at publish time. Arrow hands back missing
+    values in object columns as None (pandas 2.x); read_csv has NaN there."""
+    df = table.to_pandas()
+    for column in df.columns[df.dtypes == object]:
+        if df[column].isna().any():
+            df[column] = df[column].where(df[column].notna(), float("nan"))
+    return df
+
+
+def _has_published(directory: str) -> bool:
+    # Tables sit beside the CSVs' real paths, which may be links elsewhere
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return False
+    return any(
+        name.lower().endswith(".csv") and os.path.exists(arrow_path(os.path.join(directory, name)))
+        for name in names
+    )
+
+
+def load_arrow(csv_path: str):
+    """A local CSV as a zero-copy, read-only pyarrow.Table (DuckDB can query it directly)"""
+    table = _mapped(os.fspath(csv_path))
+    if table is not None:
+        return table
+    import pandas as pd
+    import pyarrow as pa
+
+    return pa.Table.from_pandas(pd.read_csv(csv_path), preserve_index=False)
+
+
+def load_table(csv_path: str):
+    """A local CSV as a DataFrame, converted from its Arrow table without parsing.
+    The columns are copied out of the mapped file, so the frame is writable
+    like one from read_csv; load_arrow() is the copy-free way to a large table."""
+    table = _mapped(os.fspath(csv_path))
+    if table is not None:
+        return _to_pandas(table)
+    import pandas as pd
+
+    return pd.read_csv(csv_path)
+
+
+def install():
+    """Expose load_table()/load_arrow() and serve pd.read_csv() from published tables"""
+    builtins.load_table = load_table
+    builtins.load_arrow = load_arrow
+    # Only pay for importing pandas when it is preloaded or there is something to serve
+    if "pandas" not in sys.modules and not _has_published(os.getcwd()):
+        return
+    try:
+        import pandas as pd
+    except ImportError:
+        return
+    if getattr(pd.read_csv, "_arrow_shim", False):
+        return
+    original = pd.read_csv
+
+    @functools.wraps(original)
+    def read_csv(filepath_or_buffer, *args, **kwargs):
+        if not args and set(kwargs) <= SHIM_SAFE_KWARGS and isinstance(filepath_or_buffer, (str, os.PathLike)):
+            try:
+                table = _mapped(os.fspath(filepath_or_buffer))
+            except Exception:
+                table = None
+            if table is not None:
+                return _to_pandas(table)
+        return original(filepath_or_buffer, *args, **kwargs)
+
+    read_csv._arrow_shim = True
+    pd.read_csv = read_csv
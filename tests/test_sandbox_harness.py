@@ -0,0 +1,14 @@
+import pandas as pd
+
+import sandbox_harness
+
+
+def test_int_keyed_dict_round_trips():
+    data = sandbox_harness.encode({1: "a", 2: {3: 4.5}})
+    assert sandbox_harness._json_safe(sandbox_harness.decode(data)) == {"1": "a", "2": {"3": 4.5}}
+
+
+def test_series_to_dict_round_trips(tmp_path):
+    series = pd.Series([1, 2], index=[2020, 2021])
+    (tmp_path / sandbox_harness.RESULT_FILE).write_bytes(sandbox_harness.encode(series.to_dict()))
+    assert sandbox_harness.read_result(str(tmp_path)) == {"2020": 1, "2021": 2}
@@ -0,0 +1,574 @@
+import json
+import os
+import queue
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import warnings
+from typing import Optional
+
+from dotenv import load_dotenv
+
+import sandbox_harness
+import sandbox_limits
+
+load_dotenv()
+
+# Number of warm workers; 0 disables the pool and every script runs cold
+WORKER_POOL_SIZE = int(os.getenv("WORKER_POOL_SIZE", str(min(4, os.cpu_count() or 1))))
+# Restart a worker after this many scripts to shed any state or memory it accumulated
+WORKER_MAX_JOBS = int(os.getenv("WORKER_MAX_JOBS", "50"))
+# ...or once it has been alive this long (seconds, 0 = no age limit)
+WORKER_MAX_AGE = float(os.getenv("WORKER_MAX_AGE", "3600"))
+# How long a script waits for a warm worker before running in a cold interpreter
+WORKER_CHECKOUT_TIMEOUT = float(os.getenv("WORKER_CHECKOUT_TIMEOUT", "10"))
+# After a worker fails to start, wait this long before trying again (seconds),
+# doubling per consecutive failure up to WORKER_SPAWN_BACKOFF_MAX
+WORKER_SPAWN_BACKOFF = float(os.getenv("WORKER_SPAWN_BACKOFF", "5"))
+WORKER_SPAWN_BACKOFF_MAX = float(os.getenv("WORKER_SPAWN_BACKOFF_MAX", "300"))
+
+
+# ---------------------------------------------------------------------------
+# Worker side: a long-lived interpreter that preloads the heavy libraries and
+# forks a fresh child for each script, so every run starts warm and isolated
+# ---------------------------------------------------------------------------
+
+
+def _preload():
+    started = time.time()
+    import numpy  # noqa: F401
+    import pandas  # noqa: F401
+
+    try:
+        import matplotlib
+
+        matplotlib.use("Agg")
+        import matplotlib.pyplot  # noqa: F401
+    except ImportError:
+        pass
+
+    try:
+        import seaborn  # noqa: F401
+    except ImportError:
+        pass
+
+    import duckdb
+
+    conn = duckdb.connect()
+    try:
+        conn.execute("INSTALL httpfs; LOAD httpfs;")
+        conn.execute("INSTALL parquet; LOAD parquet;")
+    except Exception as e:
+        print(f"⚠️ Worker could not preload DuckDB extensions: {e}", file=sys.stderr)
+    finally:
+        conn.close()
+    print(f"🔥 Worker {os.getpid()} warmed up in {time.time() - started:.2f}s", file=sys.stderr)
+
+
+# Write end of the reply channel, closed in forked children
+_reply_fd = None
+# Analysis kernels forked by this worker, reaped as they exit
+_kernels = []
+
+
+def _run_child(script: str, cwd: Optional[str], out_path: str, err_path: str):
+    """Body of the forked child: behave like `python script` in cwd, then exit"""
+    os.setsid()
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    if _reply_fd is not None:
+        os.close(_reply_fd)
+    code = 0
+    try:
+        sandbox_limits.apply_limits()
+        if cwd:
+            os.chdir(cwd)
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.dup2(os.open(out_path, os.O_WRONLY | os.O_TRUNC), 1)
+        os.dup2(os.open(err_path, os.O_WRONLY | os.O_TRUNC), 2)
+
+        import runpy
+
+        sandbox_harness.install()
+        script_path = os.path.abspath(script)
+        sys.argv = [script]
+        sys.path[0] = os.path.dirname(script_path)
+        runpy.run_path(script_path, run_name="__main__")
+    except SystemExit as e:
+        if e.code is None:
+            code = 0
+        elif isinstance(e.code, int):
+            code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            code = 1
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+
+def _execute(job: dict, on_start=None) -> dict:
+    out_fd, out_path = tempfile.mkstemp(prefix="worker-out-")
+    err_fd, err_path = tempfile.mkstemp(prefix="worker-err-")
+    os.close(out_fd)
+    os.close(err_fd)
+    try:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            _run_child(job["script"], job.get("cwd"), out_path, err_path)
+        if on_start is not None:
+            on_start(pid)
+
+        returncode, timed_out, kill_reason, perf = sandbox_limits.supervise(
+            pid, job.get("timeout", 120)
+        )
+
+        with open(out_path, encoding="utf-8", errors="replace") as f:
+            stdout = f.read()
+        with open(err_path, encoding="utf-8", errors="replace") as f:
+            stderr = f.read()
+        if kill_reason:
+            stderr += f"\n{kill_reason}\n"
+        return {
+            "returncode": returncode,
+            "stdout": stdout,
+            "stderr": stderr,
+            "timed_out": timed_out,
+            "perf": perf,
+        }
+    finally:
+        os.unlink(out_path)
+        os.unlink(err_path)
+
+
+def _fork_kernel(job: dict) -> dict:
+    """Fork a request's analysis kernel (see kernel.py) from this warm interpreter"""
+    import kernel
+
+    read_fd, write_fd = os.pipe()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        os.setsid()
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        os.close(read_fd)
+        if _reply_fd is not None:
+            os.close(_reply_fd)
+        try:
+            kernel.main(job["directory"], job["workspace_dir"], ready_fd=write_fd)
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            os._exit(1)
+    os.close(write_fd)
+    _kernels.append(pid)
+    with os.fdopen(read_fd) as ready:
+        line = ready.readline()
+    if not line:
+        # Died during startup, possibly before it was in _kernels
+        _reap_kernels(None, None)
+    return {"kernel": pid, "ready": bool(line.strip())}
+
+
+def _reap_kernels(signum, frame):
+    # Only the kernels: scripts are waited for by supervise()
+    for pid in list(_kernels):
+        try:
+            done, _ = os.waitpid(pid, os.WNOHANG)
+        except ChildProcessError:
+            done = pid
+        if done:
+            _kernels.remove(pid)
+
+
+def serve():
+    """Worker main loop: one JSON job per line on stdin, one JSON reply per line"""
+    global _reply_fd
+    # Keep the reply channel private; anything else printed goes to stderr
+    _reply_fd = os.dup(1)
+    replies = os.fdopen(_reply_fd, "w", buffering=1)
+    os.dup2(2, 1)
+
+    # pandas starts a helper thread on import; the forked children only run
+    # the script, so the fork-while-threaded warning is noise here
+    warnings.filterwarnings("ignore", message=".*use of fork\\(\\) may lead to deadlocks.*")
+    _preload()
+    signal.signal(signal.SIGCHLD, _reap_kernels)
+    replies.write(json.dumps({"ready": True}) + "\n")
+
+    def started(pid: int):
+        # Tells the server which process group to kill if the job is cancelled
+        replies.write(json.dumps({"started": pid}) + "\n")
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            job = json.loads(line)
+            reply = _fork_kernel(job["kernel"]) if "kernel" in job else _execute(job, started)
+        except Exception as e:
+            reply = {"error": str(e)}
+        replies.write(json.dumps(reply) + "\n")
+
+
+# ---------------------------------------------------------------------------
+# Server side: the pool of warm workers
+# ---------------------------------------------------------------------------
+
+
+class WorkerError(Exception):
+    """The worker process died or answered with something unusable"""
+
+
+class ScriptHandle:
+    """Lets another thread kill a script while it runs.
+
+    The runner reports the script's process group once it has started;
+    cancel() kills the group then, or as soon as it is reported.
+    """
+
+    def __init__(self):
+        self.pid: Optional[int] = None
+        self.cancelled = False
+        self._lock = threading.Lock()
+
+    def started(self, pid: int):
+        with self._lock:
+            self.pid = pid
+            if self.cancelled:
+                self._kill()
+
+    def finished(self):
+        with self._lock:
+            self.pid = None
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            if self.pid is not None:
+                self._kill()
+
+    def _kill(self):
+        try:
+            os.killpg(self.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            # Not yet its own group leader: it has not started anything else
+            try:
+                os.kill(self.pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+        except PermissionError:
+            pass
+
+
+class Worker:
+    def __init__(self):
+        self.proc = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+        )
+        self.started = time.time()
+        self.jobs = 0
+        ready = self._read()
+        if not ready.get("ready"):
+            raise WorkerError(f"Unexpected worker handshake: {ready}")
+
+    def _read(self) -> dict:
+        line = self.proc.stdout.readline()
+        if not line:
+            raise WorkerError(f"Worker {self.proc.pid} exited with {self.proc.poll()}")
+        return json.loads(line)
+
+    def alive(self) -> bool:
+        return self.proc.poll() is None
+
+    def expired(self) -> bool:
+        if WORKER_MAX_JOBS and self.jobs >= WORKER_MAX_JOBS:
+            return True
+        return bool(WORKER_MAX_AGE) and time.time() - self.started > WORKER_MAX_AGE
+
+    def run(
+        self, script: str, cwd: Optional[str], timeout: float, handle: Optional[ScriptHandle] = None
+    ) -> dict:
+        self.jobs += 1
+        self.proc.stdin.write(json.dumps({"script": script, "cwd": cwd, "timeout": timeout}) + "\n")
+        self.proc.stdin.flush()
+        reply = self._read()
+        if "started" in reply:
+            if handle is not None:
+                handle.started(reply["started"])
+            try:
+                reply = self._read()
+            finally:
+                if handle is not None:
+                    handle.finished()
+        if "error" in reply:
+            raise WorkerError(reply["error"])
+        return reply
+
+    def fork_kernel(self, directory: str, workspace_dir: str) -> dict:
+        self.proc.stdin.write(
+            json.dumps({"kernel": {"directory": directory, "workspace_dir": workspace_dir}}) + "\n"
+        )
+        self.proc.stdin.flush()
+        reply = self._read()
+        if "error" in reply:
+            raise WorkerError(reply["error"])
+        return reply
+
+    def close(self):
+        try:
+            self.proc.stdin.close()
+            self.proc.wait(timeout=5)
+        except Exception:
+            self.proc.kill()
+
+
+class WorkerPool:
+    """Fixed-size pool of pre-warmed interpreters for running generated scripts.
+
+    Workers are started in background threads and handed out one job at a
+    time. A worker is replaced after WORKER_MAX_JOBS scripts or WORKER_MAX_AGE
+    seconds. When no warm worker is available (pool disabled, still warming
+    up, or a worker crashed) the script runs in a cold interpreter instead.
+    If workers keep failing to start, the pool stops waiting for them and
+    retries with exponential backoff while scripts run cold.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._idle: "queue.Queue[Worker]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+        self._closed = False
+        # Workers started and not yet retired (idle or running a job)
+        self._live = 0
+        # Workers still starting up
+        self._pending = 0
+        # Consecutive failed starts, and when the next start may be tried
+        self._failures = 0
+        self._retry_at = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._started or self.size <= 0:
+                return
+            self._started = True
+            self._closed = False
+        self._replenish()
+
+    def _replenish(self):
+        """Start workers for any empty slots, unless backing off after failures"""
+        with self._lock:
+            if self._closed or not self._started or time.time() < self._retry_at:
+                return
+            missing = self.size - self._live - self._pending
+            # While degraded, probe with a single worker rather than the whole pool
+            if self._failures:
+                missing = min(missing, 1 - self._pending)
+            self._pending += max(missing, 0)
+        for _ in range(missing):
+            threading.Thread(target=self._spawn, daemon=True).start()
+
+    def _spawn(self):
+        try:
+            worker = Worker()
+        except Exception as e:
+            with self._lock:
+                self._pending -= 1
+                self._failures += 1
+                failures = self._failures
+                delay = min(WORKER_SPAWN_BACKOFF * 2 ** (failures - 1), WORKER_SPAWN_BACKOFF_MAX)
+                self._retry_at = time.time() + delay
+            print(f"⚠️ Failed to start warm worker ({failures} in a row, retrying in {delay:.0f}s): {e}")
+            return
+        with self._lock:
+            self._pending -= 1
+            self._failures = 0
+            self._retry_at = 0.0
+            if not self._closed:
+                self._live += 1
+        if self._closed:
+            worker.close()
+        else:
+            self._idle.put(worker)
+            # A worker starting again may leave more slots to refill
+            self._replenish()
+
+    def _worth_waiting(self) -> bool:
+        """A worker will become idle: one is busy, or one is starting and the
+        pool has not been failing to start them"""
+        with self._lock:
+            return self._live > 0 or (self._pending > 0 and not self._failures)
+
+    def _checkout(self) -> Optional[Worker]:
+        self.start()
+        if self.size <= 0:
+            return None
+        self._replenish()
+        try:
+            worker = self._idle.get_nowait()
+        except queue.Empty:
+            if not self._worth_waiting():
+                return None
+            try:
+                worker = self._idle.get(timeout=WORKER_CHECKOUT_TIMEOUT)
+            except queue.Empty:
+                return None
+        if not worker.alive():
+            self._retire(worker)
+            return self._checkout()
+        return worker
+
+    def _retire(self, worker: Worker):
+        worker.close()
+        with self._lock:
+            self._live -= 1
+        self._replenish()
+
+    def _checkin(self, worker: Worker):
+        if self._closed or worker.expired() or not worker.alive():
+            self._retire(worker)
+        else:
+            self._idle.put(worker)
+
+    def run(
+        self,
+        script: str,
+        cwd: Optional[str] = None,
+        timeout: float = 120,
+        handle: Optional[ScriptHandle] = None,
+    ) -> subprocess.CompletedProcess:
+        """Run a script like subprocess.run([python, script], capture_output=True, text=True).
+
+        Raises subprocess.TimeoutExpired when the script exceeds `timeout`.
+        A `handle` can be used to kill the script from another thread.
+        """
+        cwd = cwd or os.getcwd()
+        worker = self._checkout()
+        if worker is None:
+            return _run_cold(script, cwd, timeout, handle)
+        try:
+            reply = worker.run(script, cwd, timeout, handle)
+        except (WorkerError, OSError, ValueError) as e:
+            print(f"⚠️ Warm worker failed, running script cold: {e}")
+            self._retire(worker)
+            return _run_cold(script, cwd, timeout, handle)
+        self._checkin(worker)
+
+        return _completed(script, timeout, reply)
+
+    def start_kernel(self, directory: str, workspace_dir: str) -> Optional[int]:
+        """Fork an analysis kernel from a warm worker; its pid, or None if no
+        worker is available and the kernel has to start cold"""
+        worker = self._checkout()
+        if worker is None:
+            return None
+        try:
+            reply = worker.fork_kernel(directory, workspace_dir)
+        except (WorkerError, OSError, ValueError) as e:
+            print(f"⚠️ Warm worker failed to fork a kernel: {e}")
+            self._retire(worker)
+            return None
+        self._checkin(worker)
+        return reply["kernel"] if reply.get("ready") else None
+
+    def close(self):
+        self._closed = True
+        with self._lock:
+            self._started = False
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            worker.close()
+            with self._lock:
+                self._live -= 1
+
+
+def _run_cold(
+    script: str, cwd: Optional[str], timeout: float, handle: Optional[ScriptHandle] = None
+) -> subprocess.CompletedProcess:
+    # Same limits and accounting as a warm worker, in a fresh interpreter. The
+    # harness applies the limits itself: preexec_fn is unsafe from a threaded server
+    with tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+        proc = subprocess.Popen(
+            [sys.executable, sandbox_harness.__file__, script],
+            cwd=cwd,
+            stdout=out,
+            stderr=err,
+            start_new_session=True,
+        )
+        if handle is not None:
+            handle.started(proc.pid)
+        try:
+            returncode, timed_out, kill_reason, perf = sandbox_limits.supervise(proc.pid, timeout)
+        finally:
+            if handle is not None:
+                handle.finished()
+        proc.returncode = returncode
+        out.seek(0)
+        err.seek(0)
+        stdout = out.read().decode("utf-8", errors="replace")
+        stderr = err.read().decode("utf-8", errors="replace")
+    if kill_reason:
+        stderr += f"\n{kill_reason}\n"
+    return _completed(
+        script,
+        timeout,
+        {"returncode": returncode, "stdout": stdout, "stderr": stderr, "timed_out": timed_out, "perf": perf},
+    )
+
+
+def _completed(script: str, timeout: float, reply: dict) -> subprocess.CompletedProcess:
+    """Turn a worker reply into what subprocess.run would have returned or raised"""
+    print(f"📈 {os.path.basename(script)}: {sandbox_limits.format_perf(reply['perf'])}")
+    if reply["timed_out"]:
+        timeout_error = subprocess.TimeoutExpired(
+            [sys.executable, script], timeout, output=reply["stdout"], stderr=reply["stderr"]
+        )
+        timeout_error.perf = reply["perf"]
+        raise timeout_error
+    result = subprocess.CompletedProcess(
+        [sys.executable, script], reply["returncode"], reply["stdout"], reply["stderr"]
+    )
+    result.perf = reply["perf"]
+    return result
+
+
+pool = WorkerPool(WORKER_POOL_SIZE)
+
+
+async def warm_up():
+    """Codegen warm-up hook: make sure workers are starting before code arrives"""
+    pool.start()
+
+
+def run_script(
+    script: str,
+    cwd: Optional[str] = None,
+    timeout: float = 120,
+    handle: Optional[ScriptHandle] = None,
+) -> subprocess.CompletedProcess:
+    return pool.run(script, cwd=cwd, timeout=timeout, handle=handle)
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,165 @@
+import asyncio
+import fcntl
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from typing import Iterable, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+# Workspaces live on disk by default. tmpfs is faster but opt-in (for example
+# WORKSPACE_ROOT=/dev/shm/data-agent): uploads, scraped CSVs, their Arrow
+# copies and kernel files all land here, and Docker gives /dev/shm only 64 MB
+WORKSPACE_ROOT = os.getenv("WORKSPACE_ROOT") or os.path.join(tempfile.gettempdir(), "data-agent")
+# Finished workspaces are kept this long (seconds) for debugging, then removed
+WORKSPACE_MAX_AGE = float(os.getenv("WORKSPACE_MAX_AGE", "3600"))
+# Total size of finished workspaces kept around; oldest are removed first. Never
+# more than half of the filesystem holding WORKSPACE_ROOT
+WORKSPACE_QUOTA_MB = float(os.getenv("WORKSPACE_QUOTA_MB", "512"))
+# Held (flock) by the process serving a workspace, so the collector of any
+# server process can tell it is in use
+LOCK_FILE = ".lock"
+
+
+class Workspace:
+    """A private directory holding one request's data files, code and outputs"""
+
+    def __init__(self, path: str, lock_fd: Optional[int] = None):
+        self.path = path
+        self.lock_fd = lock_fd
+
+    def path_for(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def subspace(self, name: str, files: Iterable[str] = ()) -> "Workspace":
+        """A child directory for one of several competing runs.
+
+        The given data files are linked in, so code that refers to them by
+        name still finds them, while outputs stay separate per run.
+        """
+        path = self.path_for(name)
+        os.makedirs(path, exist_ok=True)
+        for src in files:
+            link = os.path.join(path, os.path.basename(src))
+            if os.path.isfile(src) and not os.path.lexists(link):
+                os.symlink(os.path.abspath(src), link)
+        return Workspace(path)
+
+
+def _in_use(path: str, now: float, max_age: float) -> bool:
+    """True while some server process holds the workspace's lock"""
+    try:
+        fd = os.open(os.path.join(path, LOCK_FILE), os.O_RDONLY)
+    except FileNotFoundError:
+        # Still being created, or left by an older version: go by age alone
+        try:
+            return now - os.path.getmtime(path) <= max_age
+        except OSError:
+            return True
+    except OSError:
+        return True
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return True
+    finally:
+        os.close(fd)
+    return False
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+class WorkspaceManager:
+    """Creates per-request workspaces and garbage-collects finished ones.
+
+    A workspace in use is locked by the process serving it and never
+    collected, whichever server process runs the collection. Finished ones
+    are removed once older than `max_age`, and the oldest are removed while
+    the total exceeds `quota_bytes`. Collection runs in a thread, off the
+    event loop, at most one at a time.
+    """
+
+    def __init__(self, root: str, max_age: float, quota_bytes: int):
+        self.root = root
+        self.max_age = max_age
+        self.quota_bytes = quota_bytes
+        self._collecting = threading.Lock()
+        self._collection = None
+
+    async def create(self) -> Workspace:
+        if self._collection is None or self._collection.done():
+            self._collection = asyncio.ensure_future(asyncio.to_thread(self.collect))
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}")
+        os.makedirs(path)
+        lock_fd = os.open(os.path.join(path, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        print(f"📁 Workspace: {path}")
+        return Workspace(path, lock_fd)
+
+    def release(self, workspace: Workspace):
+        if workspace.lock_fd is not None:
+            os.close(workspace.lock_fd)
+            workspace.lock_fd = None
+
+    def _quota(self) -> int:
+        try:
+            return min(self.quota_bytes, shutil.disk_usage(self.root).total // 2)
+        except OSError:
+            return self.quota_bytes
+
+    def collect(self, now: Optional[float] = None):
+        if not self._collecting.acquire(blocking=False):
+            return
+        try:
+            self._collect(now or time.time())
+        finally:
+            self._collecting.release()
+
+    def _collect(self, now: float):
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return
+
+        finished = []
+        for name in names:
+            path = os.path.join(self.root, name)
+            if not os.path.isdir(path) or _in_use(path, now, self.max_age):
+                continue
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            if now - mtime > self.max_age:
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                finished.append((mtime, path, _dir_size(path)))
+
+        quota = self._quota()
+        total = sum(size for _, _, size in finished)
+        for _, path, size in sorted(finished):
+            if total <= quota:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+workspaces = WorkspaceManager(
+    WORKSPACE_ROOT, WORKSPACE_MAX_AGE, int(WORKSPACE_QUOTA_MB * 1024 * 1024)
+)